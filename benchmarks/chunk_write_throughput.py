@@ -0,0 +1,85 @@
+"""
+Compare DocumentChunk write throughput: one autocommitted INSERT per chunk
+(the old ``process_document_chunk`` path) against DocumentChunkWriter with
+``bulk_create`` and binary ``COPY``.
+
+Needs the configured Postgres database with the pgvector extension. A
+throwaway team and document are created and deleted again:
+
+    python -m benchmarks.chunk_write_throughput --rows 5000
+"""
+
+import argparse
+import os
+import random
+import time
+import uuid
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+from intune.ingestion.persistence import DocumentChunkWriter
+from intune.models import Document, DocumentChunk, Team
+
+DIMENSIONS = 1536
+
+
+def write_per_row(document, rows):
+    for chunk_index, text, embedding in rows:
+        DocumentChunk.objects.create(
+            document=document,
+            team_id=document.team_id,
+            chunk_index=chunk_index,
+            text=text,
+            embedding=embedding,
+        )
+
+
+def write_with(method):
+    def write(document, rows):
+        with DocumentChunkWriter(
+            document.id, document.team_id, method=method
+        ) as writer:
+            for row in rows:
+                writer.add(*row)
+
+    return write
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rows = [
+        (
+            i,
+            f"Chunk {i} " + "lorem ipsum dolor sit amet " * 40,
+            [rng.uniform(-1, 1) for _ in range(DIMENSIONS)],
+        )
+        for i in range(args.rows)
+    ]
+
+    team = Team.objects.create(name=f"benchmark-{uuid.uuid4()}")
+    try:
+        for name, write in (
+            ("per-row INSERT", write_per_row),
+            ("bulk_create", write_with("bulk_create")),
+            ("COPY binary", write_with("copy")),
+        ):
+            document = Document.objects.create(team=team, name=name, file="bench")
+            started = time.perf_counter()
+            write(document, rows)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name:>15}: {len(rows)} rows in {elapsed:.2f}s ({len(rows) / elapsed:.0f} rows/sec)"
+            )
+    finally:
+        team.delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Compare ingestion embedding throughput: one request per page (the old
+``process_document_chunk`` path) against batched multi-input requests.
+
+Runs against a local fake embeddings server, no API key needed:
+
+    python -m benchmarks.embedding_throughput --pages 900 --workers 4
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+import httpx
+from django.conf import settings
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from intune.ingestion.embedding import embed_chunks, embed_texts, iter_embedding_batches
+
+PAGE_TEXT = (
+    "The quarterly security review covers access control, incident response "
+    "and vendor risk. Every team lead must confirm that offboarded accounts "
+    "were revoked within one business day. "
+) * 12
+
+
+def run_per_page(pages, workers):
+    # Each task used a fresh module-level httpx.post, i.e. a new connection.
+    def embed_page(page):
+        with httpx.Client() as client:
+            return len(embed_texts([page[1]], client=client))
+
+    with ThreadPoolExecutor(workers) as pool:
+        return sum(pool.map(embed_page, pages))
+
+
+def run_batched(pages, workers):
+    batches = list(iter_embedding_batches(pages))
+    with httpx.Client() as client, ThreadPoolExecutor(workers) as pool:
+        results = pool.map(lambda batch: embed_chunks(batch, client=client), batches)
+        return sum(len(embeddings) for embeddings in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=900)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--per-input-ms", type=float, default=0.5)
+    args = parser.parse_args()
+
+    pages = [(n, f"Page {n}. {PAGE_TEXT}") for n in range(1, args.pages + 1)]
+
+    with FakeOpenAIServer(args.latency_ms, args.per_input_ms) as server:
+        settings.OPENAI_API_BASE = server.base_url
+        settings.OPENAI_RATE_LIMIT_ENABLED = False
+        settings.OPENAI_API_KEY = "benchmark"
+
+        for name, run in (("per-page", run_per_page), ("batched", run_batched)):
+            requests_before = server.requests
+            started = time.perf_counter()
+            embedded = run(pages, args.workers)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name:>9}: {embedded} pages in {elapsed:.2f}s "
+                f"({embedded / elapsed:.1f} pages/sec, "
+                f"{server.requests - requests_before} requests)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+A local stand-in for the OpenAI API used by the benchmarks.
+
+It answers ``POST /v1/embeddings`` with deterministic vectors and
+``POST /v1/chat/completions`` with a canned answer after a configurable
+delay, so throughput numbers reflect request counts and connection handling
+rather than the real service. Streamed completions (``"stream": true``)
+send the answer word by word, ``token_ms`` apart.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSIONS = 1536
+CANNED_ANSWER = 'This is a canned answer.<hr/><div class="llm-sources"><ol></ol></div>'
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count_connection()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path.endswith("/embeddings"):
+            body = self.server.embeddings_response(payload)
+        elif self.path.endswith("/chat/completions") and payload.get("stream"):
+            self.stream_chat_response()
+            return
+        elif self.path.endswith("/chat/completions"):
+            body = self.server.chat_response(payload)
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream_chat_response(self):
+        # Chunked, so the connection can be kept alive after the stream.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for event in self.server.chat_stream_events():
+            data = f"data: {event}\n\n".encode()
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Accept bursts of concurrent connections without resetting them.
+    request_queue_size = 256
+
+    def __init__(self, latency_ms=50.0, per_input_ms=0.5, token_ms=20.0):
+        super().__init__(("127.0.0.1", 0), FakeOpenAIHandler)
+        self.latency = latency_ms / 1000
+        self.per_input = per_input_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.requests = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        vector = ", ".join(f"{(i % 97) / 97:.6f}" for i in range(DIMENSIONS))
+        self._vector_json = f"[{vector}]"
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f"http://{host}:{port}/v1"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def embeddings_response(self, payload):
+        self.count_request()
+        inputs = payload.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(self.latency + self.per_input * len(inputs))
+        items = ", ".join(
+            f'{{"object": "embedding", "index": {i}, "embedding": {self._vector_json}}}'
+            for i in range(len(inputs))
+        )
+        return f'{{"object": "list", "data": [{items}]}}'.encode()
+
+    def chat_response(self, payload):
+        self.count_request()
+        time.sleep(self.latency)
+        message = {"role": "assistant", "content": CANNED_ANSWER}
+        return json.dumps(
+            {"object": "chat.completion", "choices": [{"index": 0, "message": message}]}
+        ).encode()
+
+    def chat_stream_events(self):
+        self.count_request()
+        time.sleep(self.latency)
+        for word in CANNED_ANSWER.split(" "):
+            time.sleep(self.token_delay)
+            delta = {"index": 0, "delta": {"content": f"{word} "}}
+            yield json.dumps({"object": "chat.completion.chunk", "choices": [delta]})
+        yield "[DONE]"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
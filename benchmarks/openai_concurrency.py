@@ -0,0 +1,157 @@
+"""
+Measure how soon the answer of a new chat starts streaming, before and
+after starting a chat stopped waiting on OpenAI.
+
+"before" is the old flow: each chat requests its title, then embeds the
+question, then streams the answer, one call after another and every call
+on a new connection, as module-level ``httpx.post`` did. "after" is the
+current one: ``generate_chat_title`` and ``answer_question`` are separate
+Celery tasks, so the title is written while the answer streams, and both
+use the worker's shared keep-alive ``httpx.Client``. A pool of
+``--workers`` threads stands in for the worker's concurrency.
+
+Runs against a local fake server in a separate process (so it doesn't
+compete with the client for the GIL), no API key or database needed:
+
+    python -m benchmarks.openai_concurrency --chats 200 --workers 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import httpx
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+from django.conf import settings
+
+from benchmarks.fake_openai import FakeOpenAIServer
+from intune.openai_client import client_options, post_json, stream_chat_completion
+from intune.tokens import count_tokens
+from intune.utils import (
+    chat_title_request,
+    estimate_completion_tokens,
+    llm_request,
+    parse_chat_title,
+)
+
+QUESTION = "How many vacation days do new employees get in their first year?"
+
+
+def serve(latency_ms, token_ms, base_url, connections):
+    with FakeOpenAIServer(latency_ms, token_ms=token_ms) as server:
+        base_url.put(server.base_url)
+        while True:
+            connections.value = server.connections
+            time.sleep(0.01)
+
+
+def title(question, client):
+    request = chat_title_request(question)
+    tokens = estimate_completion_tokens(request)
+    data = post_json(
+        "chat/completions", request, request["model"], tokens, client=client
+    )
+    return parse_chat_title(data)
+
+
+def answer(question, client, started):
+    """Embed ``question`` and stream an answer; returns the time to first token."""
+    request = {"input": question, "model": settings.EMBEDDING_MODEL}
+    post_json(
+        "embeddings",
+        request,
+        settings.EMBEDDING_MODEL,
+        count_tokens(question),
+        client=client,
+    )
+    request = llm_request(question)
+    first_token = None
+    for _ in stream_chat_completion(
+        request, estimate_completion_tokens(request), client=client
+    ):
+        if first_token is None:
+            first_token = time.perf_counter() - started
+    return first_token
+
+
+def fresh_client():
+    return httpx.Client(**client_options())
+
+
+def chat_before(question, started):
+    with fresh_client() as client:
+        title(question, client)
+    with fresh_client() as client:
+        return answer(question, client, started)
+
+
+def run_before(pool, questions):
+    started = time.perf_counter()
+    futures = [pool.submit(chat_before, question, started) for question in questions]
+    return [future.result() for future in futures]
+
+
+def run_after(pool, questions):
+    # The view queues both tasks at once; None means the shared client.
+    started = time.perf_counter()
+    futures = []
+    for question in questions:
+        futures.append(pool.submit(answer, question, None, started))
+        pool.submit(title, question, None)
+    return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    base_url = multiprocessing.Queue()
+    connections = multiprocessing.Value("i", 0)
+    server = multiprocessing.Process(
+        target=serve,
+        args=(args.latency_ms, args.token_ms, base_url, connections),
+        daemon=True,
+    )
+    server.start()
+    settings.OPENAI_API_BASE = base_url.get()
+    settings.OPENAI_RATE_LIMIT_ENABLED = False
+    settings.OPENAI_API_KEY = "benchmark"
+
+    print(
+        f"{args.chats} chats, {args.workers} worker threads, "
+        f"{args.latency_ms:.0f} ms per OpenAI call"
+    )
+    try:
+        for name, run in (("before", run_before), ("after", run_after)):
+            # Distinct questions, as a real workload would send.
+            questions = [f"{QUESTION} ({uuid.uuid4()})" for _ in range(args.chats)]
+            opened = connections.value
+            with ThreadPoolExecutor(args.workers) as pool:
+                started = time.perf_counter()
+                first_tokens = run(pool, questions)
+            elapsed = time.perf_counter() - started
+            time.sleep(0.05)
+            print(
+                f"{name:>6}: {args.chats / elapsed:6.1f} chats/sec  "
+                f"first token p50 {statistics.median(first_tokens) * 1000:7.1f} ms  "
+                f"p95 {statistics.quantiles(first_tokens, n=20)[-1] * 1000:7.1f} ms  "
+                f"{connections.value - opened} connections"
+            )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
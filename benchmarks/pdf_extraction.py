@@ -0,0 +1,72 @@
+"""
+Compare single-process PDF text extraction against the parallel
+page-range extraction in ``iter_pdf_pages``.
+
+Generates a multi-thousand-page text PDF in a temporary directory:
+
+    python -m benchmarks.pdf_extraction --pages 3000 --workers 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+import pymupdf
+
+from intune.ingestion.extraction import iter_pdf_pages
+
+PARAGRAPH = (
+    "Employees accrue paid time off every pay period. Unused days roll over "
+    "up to the cap defined in the regional appendix, and requests longer "
+    "than five consecutive days need approval from the team lead. "
+)
+
+
+def generate_pdf(path, pages):
+    doc = pymupdf.open()
+    for n in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_textbox(
+            pymupdf.Rect(50, 50, 550, 800), f"Page {n}\n\n" + PARAGRAPH * 14
+        )
+    doc.save(path)
+    doc.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=3000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pages-per-range", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "benchmark.pdf")
+        generate_pdf(path, args.pages)
+
+        for name, workers in (("sequential", 1), ("parallel", args.workers)):
+            started = time.perf_counter()
+            first_page_at = None
+            characters = 0
+            for page_number, text in iter_pdf_pages(
+                path, workers=workers, pages_per_range=args.pages_per_range
+            ):
+                if first_page_at is None:
+                    first_page_at = time.perf_counter() - started
+                characters += len(text)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{name:>10} ({workers} workers): {args.pages} pages in {elapsed:.2f}s "
+                f"({args.pages / elapsed:.0f} pages/sec, first page after "
+                f"{first_page_at * 1000:.0f}ms, {characters} characters)"
+            )
+
+
+if __name__ == "__main__":
+    main()
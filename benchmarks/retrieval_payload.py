@@ -0,0 +1,168 @@
+"""
+Measure what one retrieval query sends back from Postgres: bytes received
+and the client time spent after the last byte arrived (decoding rows and
+building objects), before and after the lean retrieval projection.
+
+"before" is the queryset the chat views used to run: every DocumentChunk
+column, including the embedding as text, plus the whole document through
+select_related, with its metadata dumped to JSON per snippet. "after" is
+search_chunks, which copies out only the columns prompts use, in binary,
+first without re-ranking and then with the default settings: MMR over
+RETRIEVAL_CANDIDATES candidates, which returns their pairwise similarities
+instead of their embeddings and reads the texts of the picked chunks only.
+
+The database connection goes through a local proxy that counts the bytes.
+Needs the configured Postgres database:
+
+    python -m benchmarks.retrieval_payload --chunks 2000
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+import uuid
+
+import django
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+from django.db import connection
+from django.test.utils import override_settings
+from pgvector.django import CosineDistance
+
+from intune.ingestion.persistence import DocumentChunkWriter
+from intune.models import Document, DocumentChunk, Team
+from intune.retrieval.search import search_chunks
+
+
+class CountingProxy:
+    """Forward TCP connections to ``address``, counting the bytes received."""
+
+    def __init__(self, address):
+        self.address = address
+        self.received = 0
+        self.last_received_at = None
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            client, _ = self.server.accept()
+            upstream = socket.create_connection(self.address)
+            # Without this, Nagle's algorithm adds delays to every response.
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            for source, target, count in (
+                (client, upstream, False),
+                (upstream, client, True),
+            ):
+                threading.Thread(
+                    target=self.pump, args=(source, target, count), daemon=True
+                ).start()
+
+    def pump(self, source, target, count):
+        while data := source.recv(65536):
+            if count:
+                self.received += len(data)
+                self.last_received_at = time.perf_counter()
+            target.sendall(data)
+
+    def reset(self):
+        self.received = 0
+        self.last_received_at = None
+
+
+def before(team, query_embedding, limit):
+    chunks = list(
+        DocumentChunk.objects.annotate(
+            distance=CosineDistance("embedding", query_embedding)
+        )
+        .filter(team=team, document__is_searchable=True)
+        .select_related("document")
+        .order_by("distance")[:limit]
+    )
+    for chunk in chunks:
+        if chunk.document.metadata:
+            json.dumps(chunk.document.metadata, ensure_ascii=False)
+    return chunks
+
+
+def after(team, query_embedding, limit):
+    return search_chunks(team, query_embedding, limit=limit)
+
+
+def create_team(rng, chunks):
+    team = Team.objects.create(name=f"benchmark-{uuid.uuid4()}")
+    document = Document.objects.create(
+        team=team,
+        name="handbook.pdf",
+        file="documents/handbook.pdf",
+        metadata={"title": "Employee handbook", "pages": chunks // 2},
+        is_searchable=True,
+        chunk_count=chunks,
+    )
+    with DocumentChunkWriter(document.id, team.id) as writer:
+        for i in range(chunks):
+            text = f"Paragraph {i} of the handbook. " * 40
+            writer.add(i, text, rng.normal(size=1536).astype("f4"), {"pages": [i]})
+    return team
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    team = create_team(rng, args.chunks)
+    team_id = team.id
+    queries = rng.normal(size=(args.queries, 1536)).tolist()
+
+    settings_dict = connection.settings_dict
+    proxy = CountingProxy(
+        (settings_dict["HOST"] or "127.0.0.1", int(settings_dict["PORT"] or 5432))
+    )
+    connection.close()
+    settings_dict["HOST"], settings_dict["PORT"] = "127.0.0.1", proxy.port
+
+    variants = [
+        ("before", before, {}),
+        ("after, no MMR", after, {"RETRIEVAL_MMR_ENABLED": False}),
+        ("after, default", after, {}),
+    ]
+    print(f"{args.chunks} chunks, {args.queries} queries, k={args.k}")
+    try:
+        for name, search, overrides in variants:
+            received, decode, total = [], [], []
+            with override_settings(IN_MEMORY_VECTOR_INDEX_ENABLED=False, **overrides):
+                search(team, queries[0], args.k)
+                for query in queries:
+                    proxy.reset()
+                    started = time.perf_counter()
+                    search(team, query, args.k)
+                    finished = time.perf_counter()
+                    received.append(proxy.received)
+                    decode.append(finished - proxy.last_received_at)
+                    total.append(finished - started)
+            print(
+                f"{name:>14}: {statistics.mean(received) / 1024:8.1f} KB/query  "
+                f"after last byte p50 {statistics.median(decode) * 1000:6.2f} ms  "
+                f"total p50 {statistics.median(total) * 1000:6.2f} ms"
+            )
+    finally:
+        connection.close()
+        settings_dict["HOST"], settings_dict["PORT"] = proxy.address
+        Team.objects.filter(id=team_id).delete()
+
+
+if __name__ == "__main__":
+    main()
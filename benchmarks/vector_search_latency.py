@@ -0,0 +1,143 @@
+"""
+Compare top-k vector search latency: sequential scan (what retrieval did
+before the HNSW index) against the HNSW index at several ef_search values.
+
+For each size, a throwaway table is filled with clustered random vectors and
+indexed with the VECTOR_INDEX_M / VECTOR_INDEX_EF_CONSTRUCTION settings. The
+script reports p50/p95 query latency and recall@k against exact results.
+Needs the configured Postgres database with the pgvector extension:
+
+    python -m benchmarks.vector_search_latency --rows 100000 1000000
+
+1M rows of 1536 dimensions take about 6 GB on disk. Building the index is
+much faster with --maintenance-work-mem large enough to hold the graph.
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import django
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "intune.settings")
+django.setup()
+
+from django.conf import settings
+from django.db import connection, transaction
+from pgvector.psycopg import register_vector
+
+DIMENSIONS = 1536
+TABLE = "benchmark_vector_search"
+COPY_BATCH = 10000
+
+
+def random_vectors(rng, centers, count):
+    # Chunks of real documents cluster by topic; uniform noise would make
+    # every neighbour equally far away and the index look worse than it is.
+    vectors = centers[rng.integers(len(centers), size=count)]
+    vectors = vectors + rng.normal(scale=0.3, size=vectors.shape)
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("<f4")
+
+
+def load(cursor, rng, centers, rows):
+    cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cursor.execute(
+        f"CREATE UNLOGGED TABLE {TABLE} (id bigint, embedding vector({DIMENSIONS}))"
+    )
+    with cursor.cursor.copy(
+        f"COPY {TABLE} (id, embedding) FROM STDIN WITH (FORMAT BINARY)"
+    ) as copy:
+        copy.set_types(["int8", "vector"])
+        for start in range(0, rows, COPY_BATCH):
+            count = min(COPY_BATCH, rows - start)
+            for offset, vector in enumerate(random_vectors(rng, centers, count)):
+                copy.write_row((start + offset, vector))
+    cursor.execute(f"ANALYZE {TABLE}")
+
+
+def search(cursor, query, k, ef_search=None):
+    with transaction.atomic():
+        if ef_search is None:
+            cursor.execute("SET LOCAL enable_indexscan = off")
+        else:
+            cursor.execute(
+                "SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)]
+            )
+        started = time.perf_counter()
+        cursor.execute(
+            f"SELECT id FROM {TABLE} ORDER BY embedding <=> %s LIMIT %s", [query, k]
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        return ids, time.perf_counter() - started
+
+
+def report(name, latencies, recall=None):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    line = f"{name:>22}: p50 {p50:8.2f} ms  p95 {p95:8.2f} ms"
+    if recall is not None:
+        line += f"  recall {recall:.3f}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=4)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--maintenance-work-mem", default="1GB")
+    parser.add_argument("--keep", action="store_true", help="Keep the last table.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(256, DIMENSIONS))
+    queries = random_vectors(rng, centers, args.queries)
+
+    connection.ensure_connection()
+    register_vector(connection.connection)
+    with connection.cursor() as cursor:
+        try:
+            for rows in args.rows:
+                print(f"{rows} rows, {args.queries} queries, k={args.k}")
+                started = time.perf_counter()
+                load(cursor, rng, centers, rows)
+                print(f"{'load':>22}: {time.perf_counter() - started:.1f}s")
+
+                exact, latencies = [], []
+                for query in queries:
+                    ids, elapsed = search(cursor, query, args.k)
+                    exact.append(set(ids))
+                    latencies.append(elapsed)
+                report("sequential scan", latencies)
+
+                cursor.execute(
+                    "SELECT set_config('maintenance_work_mem', %s, false)",
+                    [args.maintenance_work_mem],
+                )
+                started = time.perf_counter()
+                cursor.execute(
+                    f"CREATE INDEX ON {TABLE} USING hnsw (embedding vector_cosine_ops) "
+                    f"WITH (m = {settings.VECTOR_INDEX_M}, "
+                    f"ef_construction = {settings.VECTOR_INDEX_EF_CONSTRUCTION})"
+                )
+                print(f"{'build HNSW index':>22}: {time.perf_counter() - started:.1f}s")
+
+                for ef_search in args.ef_search:
+                    found, latencies = 0, []
+                    for query, expected in zip(queries, exact):
+                        ids, elapsed = search(cursor, query, args.k, ef_search)
+                        found += len(expected.intersection(ids))
+                        latencies.append(elapsed)
+                    recall = found / sum(len(expected) for expected in exact)
+                    report(f"HNSW ef_search={ef_search}", latencies, recall)
+        finally:
+            if not args.keep:
+                cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from intune.cache import get_async_redis, get_redis
+from intune.models import ChatConversation
+from intune.openai_client import OpenAIError
+from intune.retrieval.answer_cache import cache_answer, find_cached_answer
+from intune.retrieval.context import pack_history, pack_snippets, prompt_token_counts
+from intune.retrieval.search import search_chunks
+from intune.timing import StageTimer
+from intune.tokens import truncate_to_tokens
+from intune.utils import get_query_embedding, stream_llm_response
+
+logger = logging.getLogger(__name__)
+
+
+def answer_prompt(context_text, user_query):
+    # Strict output format:
+    # 1) One single paragraph answer (no line breaks)
+    # 2) Followed by an HTML divider <hr/>
+    # 3) Then a <div class="llm-sources"> block containing an ordered list <ol>
+    #    where each <li> contains: the clickable HTML link, the doc+chunk tag, and "Confidence: XX%"
+    # 4) Nothing else. If the answer is unknown, respond exactly: "I don't know." and still include the sources block (which can be empty)
+    return f"""
+        You are an intelligent assistant that answers using ONLY the provided document snippets.
+
+        Each snippet starts with a header line giving its doc id and chunk index, followed by a "link:" line which contains a ready-to-use HTML <a> tag linking to that document. Use those links in the sources block below if you cite a document. Do NOT invent URLs.
+
+        RESTRICTIONS:
+        - Use ONLY the facts directly present in the snippets below. Do not hallucinate.
+        - If the answer cannot be found in the provided context, reply exactly: "I don't know."
+        - The output must follow the exact format described below (no extra commentary).
+
+        CONTEXT:
+        {context_text}
+
+        USER QUESTION:
+        {user_query}
+
+        OUTPUT FORMAT (required):
+        1) Provide a single, clear, factual paragraph answering the user's question. This paragraph must contain no line breaks.
+        2) Immediately after the paragraph output a horizontal rule: <hr/>
+        3) After the <hr/>, output an HTML sources block exactly as follows:
+
+        <div class="llm-sources">
+        <ol>
+            <!-- For each source the model used, output one <li> -->
+            <li> <document_html_link> — [sources: doc <doc_id> chunk <chunk_index>] — Confidence: <confidence>%</li>
+            <!-- repeat for each used snippet -->
+        </ol>
+        </div>
+
+        - <document_html_link> must be one of the "link:" values provided in the snippet context (do not alter them).
+        - <doc_id> and <chunk_index> must match the doc id and chunk index from the snippets.
+        - <confidence> must be an integer between 0 and 100 representing the model's confidence that the cited snippet supports the answer (higher => more confident).
+        - Only include snippets you actually relied on. Order them from most to least important.
+        - If you answer "I don't know.", still include the sources block; it may be empty (<ol></ol>) or include the nearest matches the model inspected, but set confidence values appropriately (low if not confident).
+
+        EXAMPLES (illustrative — do not output these examples):
+        - Correct single-paragraph answer followed by sources block:
+        <single paragraph here><hr/><div class="llm-sources"><ol><li><a href="...">Doc A</a> — [sources: doc 12 chunk 0] — Confidence: 87%</li></ol></div>
+
+        Now answer the USER QUESTION using the context and follow the OUTPUT FORMAT exactly.
+        """
+
+
+def follow_up_prompt(summary_text, conversation_text, context_text, user_query):
+    return f"""
+        You are an intelligent assistant that answers using ONLY the provided document snippets and the conversation so far.
+
+        GUIDELINES:
+        - Use ONLY facts contained in the provided snippets, the conversation summary and the recent conversation history below. Do not hallucinate or add outside facts.
+        - If the answer cannot be found in the provided context, reply exactly: "I don't know."
+        - The output MUST follow the exact HTML format described below (no extra commentary, no extra line breaks).
+
+        CONVERSATION SUMMARY (everything before the recent conversation):
+        {summary_text or "(none)"}
+
+        RECENT CONVERSATION (oldest -> newest):
+        {conversation_text}
+
+        DOCUMENT SNIPPETS (each snippet has a header line with its doc id and chunk index, then a 'link:' line with a ready-to-use <a> tag):
+        {context_text}
+
+        USER QUESTION:
+        {user_query}
+
+        OUTPUT FORMAT (required):
+        1) A single, clear, factual paragraph answering the user's question. This paragraph must contain no line breaks.
+        2) Immediately after the paragraph output a horizontal rule: <hr/>
+        3) After the <hr/>, output an HTML sources block exactly as follows:
+
+        <div class="llm-sources">
+        <ol>
+            <!-- For each source the model used, output one <li> -->
+            <li> <document_html_link> — [sources: doc <doc_id> chunk <chunk_index>] — Confidence: <confidence>%</li>
+            <!-- repeat for each used snippet -->
+        </ol>
+        </div>
+
+        RULES FOR THE SOURCES BLOCK:
+        - Use only the provided 'link:' values; do not invent or change URLs.
+        - For each cited snippet, provide the doc id and chunk index that match the snippet header.
+        - For Confidence, provide an integer 0–100. You can use the 'confidence' (estimated from distance) in each snippet header as guidance, but choose values that reflect your internal judgement; order snippets from most to least important.
+        - If answering "I don't know.", still include the sources block (it may be empty: <ol></ol>) or include the nearest matches inspected, with low confidence scores.
+
+        Now answer the USER QUESTION following the OUTPUT FORMAT exactly.
+        """
+
+
+class PendingAnswer:
+    """Everything needed to answer, and then save the answer to, a question."""
+
+    def __init__(self, chat, question, query_embedding, documents_version):
+        self.chat = chat
+        self.question = question
+        self.query_embedding = query_embedding
+        self.documents_version = documents_version
+        self.prompt = None
+        self.chunks = []
+        self.cached_answer = None
+
+
+def unanswered_question(chat):
+    """The newest message of ``chat`` if it is a question without an answer."""
+    last = ChatConversation.objects.filter(chat=chat).order_by("-created_at").first()
+    if last is not None and last.sender == "user":
+        return last
+    return None
+
+
+def prepare_answer(chat, question, timer):
+    """
+    Embed ``question``, the unanswered question of ``chat``, retrieve and
+    pack its snippets and build the prompt. Returns a ``PendingAnswer``.
+    Raises ``OpenAIError`` if the question can't be embedded.
+
+    The first question of a chat is looked up in the team's answer cache
+    first; follow-ups are answered with the recent conversation.
+    """
+    team = chat.team
+    pending = PendingAnswer(chat, question.message, None, team.documents_version)
+    with timer.stage("embed"):
+        pending.query_embedding = get_query_embedding(question.message)
+    if pending.query_embedding is None:
+        raise OpenAIError(f"Could not embed the question of chat {chat.id}")
+
+    first_question = not chat.is_conversation_active
+    if first_question:
+        # A teammate may already have asked (nearly) the same question.
+        cached = find_cached_answer(
+            team, pending.query_embedding, pending.documents_version
+        )
+        if cached:
+            pending.cached_answer = cached.answer
+            return pending
+
+    chunks = search_chunks(
+        team,
+        pending.query_embedding,
+        limit=settings.PROMPT_MAX_SNIPPETS,
+        query_text=question.message,
+        timer=timer,
+    )
+    if first_question:
+        context_text, pending.chunks = pack_snippets(chunks)
+        pending.prompt = answer_prompt(context_text, question.message)
+        sections = {"snippets": context_text}
+    else:
+        # Older messages are covered by the chat's summary.
+        history = ChatConversation.objects.filter(
+            chat=chat, created_at__lt=question.created_at
+        )
+        if chat.summarized_until:
+            history = history.filter(created_at__gt=chat.summarized_until)
+        history = history.order_by("-created_at")[: settings.PROMPT_HISTORY_MESSAGES]
+        # reverse so oldest -> newest when sending to LLM
+        conversation_text = pack_history(list(reversed(history)))
+        summary_text = truncate_to_tokens(chat.summary, settings.CHAT_SUMMARY_TOKENS)
+        context_text, pending.chunks = pack_snippets(
+            chunks, estimate_confidence=True, single_line=True
+        )
+        pending.prompt = follow_up_prompt(
+            summary_text, conversation_text, context_text, question.message
+        )
+        sections = {
+            "summary": summary_text,
+            "history": conversation_text,
+            "snippets": context_text,
+        }
+
+    token_counts = prompt_token_counts(
+        pending.prompt, question=question.message, **sections
+    )
+    logger.debug("Prompt tokens for chat %s: %s", chat.id, token_counts)
+    return pending
+
+
+def save_answer(pending, answer):
+    """Store the finished ``answer`` of ``pending`` in its chat."""
+    chat = pending.chat
+    ChatConversation.objects.create(chat=chat, sender="bot", message=answer)
+    if pending.cached_answer is None and not chat.is_conversation_active:
+        cache_answer(
+            chat.team,
+            pending.documents_version,
+            pending.question,
+            pending.query_embedding,
+            pending.chunks,
+            answer,
+        )
+    if not chat.is_conversation_active:
+        chat.is_conversation_active = True
+        chat.save()
+
+
+def stream_answer(chat, question):
+    """
+    Answer ``question``, the unanswered question of ``chat``, yielding the
+    answer in pieces as the model writes it, and save it once it is
+    complete. Nothing is saved if the stream fails. Raises ``OpenAIError``
+    if the model can't be reached.
+    """
+    timer = StageTimer()
+    started = time.perf_counter()
+    pending = prepare_answer(chat, question, timer)
+
+    if pending.cached_answer is not None:
+        answer = pending.cached_answer
+        yield answer
+    else:
+        parts = []
+        with timer.stage("generate"):
+            for text in stream_llm_response(pending.prompt):
+                if not parts:
+                    first_token = time.perf_counter() - started
+                    logger.info(
+                        "First token for chat %s after %.3fs", chat.id, first_token
+                    )
+                parts.append(text)
+                yield text
+        answer = "".join(parts)
+
+    logger.info("Answered chat %s: %s", chat.id, timer.timings)
+    if answer:
+        save_answer(pending, answer)
+
+
+def answer_stream_key(question_id):
+    return f"chat-answer:{question_id}"
+
+
+def publish_answer_event(key, event, data):
+    pipeline = get_redis().pipeline()
+    pipeline.xadd(key, {"event": event, "data": json.dumps(data)})
+    pipeline.expire(key, settings.ANSWER_STREAM_TTL)
+    pipeline.execute()
+
+
+def publish_answer(chat, question):
+    """
+    Answer ``question`` of ``chat`` and publish the answer to the question's
+    Redis stream as it is written: ``delta`` events with its pieces, then
+    ``done`` once it is saved, or ``failed``.
+    """
+    key = answer_stream_key(question.id)
+    answered = False
+    try:
+        # The completion streams over the process-wide client, so every
+        # answer of a worker process reuses its keep-alive connections.
+        for text in stream_answer(chat, question):
+            publish_answer_event(key, "delta", text)
+            answered = True
+    except OpenAIError as exc:
+        logger.warning("Failed to get LLM response for chat %s: %s", chat.id, exc)
+        answered = False
+    except Exception:
+        publish_answer_event(key, "failed", "The assistant ran into an error.")
+        raise
+    if answered:
+        publish_answer_event(key, "done", None)
+    else:
+        publish_answer_event(key, "failed", "The assistant is unavailable.")
+
+
+async def read_answer_events(question_id):
+    """
+    Yield the ``(event, data)`` pairs published for ``question_id``, from
+    the first, until ``done`` or ``failed``. ``data`` is JSON. Yields
+    ``(None, None)`` every few seconds while waiting, and gives up with
+    ``failed`` after ANSWER_STREAM_IDLE_TIMEOUT seconds without events.
+    """
+    redis = get_async_redis()
+    key = answer_stream_key(question_id)
+    last_id = "0"
+    idle_since = time.monotonic()
+    while True:
+        response = await redis.xread({key: last_id}, block=15000, count=100)
+        if not response:
+            if time.monotonic() - idle_since > settings.ANSWER_STREAM_IDLE_TIMEOUT:
+                yield "failed", json.dumps("The assistant is taking too long.")
+                return
+            yield None, None
+            continue
+        idle_since = time.monotonic()
+        for entry_id, fields in response[0][1]:
+            last_id = entry_id
+            event = fields[b"event"].decode()
+            yield event, fields[b"data"].decode()
+            if event != "delta":
+                return
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class IntuneConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "intune"
+
+    def ready(self):
+        from intune import signals  # noqa: F401
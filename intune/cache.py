@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_redis_client = None
+_async_redis_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Return the process-wide Redis client for ``settings.REDIS_URL``."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis_client
+
+
+def get_async_redis():
+    """Return the ``redis.asyncio`` client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_redis_clients.get(loop)
+    if client is None:
+        client = _async_redis_clients[loop] = redis.asyncio.Redis.from_url(
+            settings.REDIS_URL
+        )
+    return client
+
+
+def pack_vector(vector):
+    """Pack a vector as little-endian float32 bytes (6 KB for 1536 dims)."""
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def unpack_vector(data):
+    return np.frombuffer(data, dtype="<f4")
+
+
+class LRUCache:
+    """
+    A small thread-safe in-process LRU mapping bounded by item count, or by
+    the sum of ``sizeof(value)`` over its items if given.
+    """
+
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self.sizeof(self._items[key])
+            self._items[key] = value
+            self._items.move_to_end(key)
+            self.size += self.sizeof(value)
+            # The newest item stays even if it alone is over the limit.
+            while self.size > self.max_size and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
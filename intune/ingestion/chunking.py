@@ -0,0 +1,167 @@
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from intune.tokens import count_tokens
+
+# A piece of a document ready to be embedded. ``metadata`` records where it
+# came from, e.g. ``{"pages": [3, 4]}`` or ``{"sections": [7]}``.
+Chunk = namedtuple("Chunk", ["index", "text", "metadata"])
+
+# A sentence (or a slice of an overlong sentence) inside the sliding window.
+_Unit = namedtuple("_Unit", ["text", "tokens", "location", "ends_paragraph"])
+
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+")
+_SENTENCE_END = (".", "!", "?", ":")
+
+
+class PageChunker:
+    """One chunk per non-empty page (or section), indexed by its number."""
+
+    def chunk(self, pages, location_key="pages"):
+        for page_number, text in pages:
+            text = text.strip()
+            if text:
+                yield Chunk(page_number, text, {location_key: [page_number]})
+
+
+class SlidingWindowChunker:
+    """
+    Pack sentences into chunks of about ``target_tokens`` tokens, repeating
+    up to ``overlap_tokens`` tokens from the end of each chunk at the start
+    of the next one.
+
+    Pages (or text sections) are consumed one at a time and a chunk is
+    yielded as soon as it is full, so only the current window is ever held in
+    memory. Chunks can span page breaks; the numbers of the pages a chunk
+    came from are stored under ``location_key`` in its metadata. A chunk is
+    cut at the last paragraph break that leaves it at least half full,
+    otherwise at the last sentence break.
+
+    Text sections always end a paragraph; the end of a page only does when
+    it ends like a sentence.
+    """
+
+    def __init__(self, target_tokens=None, overlap_tokens=None):
+        self.target_tokens = target_tokens or settings.CHUNK_TARGET_TOKENS
+        if overlap_tokens is None:
+            overlap_tokens = settings.CHUNK_OVERLAP_TOKENS
+        self.overlap_tokens = min(overlap_tokens, self.target_tokens // 2)
+
+    def chunk(self, pages, location_key="pages"):
+        window, overlap, window_tokens, index = [], 0, 0, 0
+        sections = location_key != "pages"
+
+        for page_number, text in pages:
+            for unit in self._units(page_number, text, sections):
+                # ``window[:overlap]`` was already emitted; only cut once
+                # there is something new in the window.
+                while (
+                    len(window) > overlap
+                    and window_tokens + unit.tokens > self.target_tokens
+                ):
+                    cut = self._cut_point(window, overlap)
+                    yield self._make_chunk(index, window[:cut], location_key)
+                    index += 1
+                    carried = self._overlap(window[:cut])
+                    window = carried + window[cut:]
+                    overlap = len(carried)
+                    window_tokens = sum(u.tokens for u in window)
+
+                window.append(unit)
+                window_tokens += unit.tokens
+
+        if len(window) > overlap:
+            yield self._make_chunk(index, window, location_key)
+
+    def _units(self, page_number, text, section=False):
+        paragraphs = [
+            " ".join(paragraph.split()) for paragraph in _PARAGRAPH_BREAK_RE.split(text)
+        ]
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+        # Leave room for the overlap so no chunk grows past the target.
+        max_unit_tokens = self.target_tokens - self.overlap_tokens
+
+        for position, paragraph in enumerate(paragraphs, start=1):
+            pieces = []
+            for sentence in _SENTENCE_BREAK_RE.split(paragraph):
+                pieces.extend(self._split_sentence(sentence, max_unit_tokens))
+
+            # The last paragraph of a page usually continues on the next
+            # page unless it ends like a sentence.
+            ends_paragraph = (
+                section
+                or position < len(paragraphs)
+                or paragraph.endswith(_SENTENCE_END)
+            )
+            for i, (piece, tokens) in enumerate(pieces, start=1):
+                yield _Unit(
+                    piece, tokens, page_number, ends_paragraph and i == len(pieces)
+                )
+
+    def _split_sentence(self, sentence, max_tokens):
+        tokens = count_tokens(sentence)
+        if tokens <= max_tokens:
+            return [(sentence, tokens)]
+
+        pieces, words, words_tokens = [], [], 0
+        for word in sentence.split():
+            word_tokens = count_tokens(word)
+            if words and words_tokens + word_tokens > max_tokens:
+                pieces.append((" ".join(words), words_tokens))
+                words, words_tokens = [], 0
+            words.append(word)
+            words_tokens += word_tokens
+        if words:
+            pieces.append((" ".join(words), words_tokens))
+        return pieces
+
+    def _cut_point(self, window, overlap):
+        tokens, best = 0, len(window)
+        for i, unit in enumerate(window, start=1):
+            tokens += unit.tokens
+            if (
+                i > overlap
+                and unit.ends_paragraph
+                and tokens >= self.target_tokens // 2
+            ):
+                best = i
+        return best
+
+    def _overlap(self, units):
+        carried, tokens = [], 0
+        for unit in reversed(units):
+            if tokens + unit.tokens > self.overlap_tokens:
+                break
+            carried.insert(0, unit)
+            tokens += unit.tokens
+        return carried
+
+    def _make_chunk(self, index, units, location_key):
+        parts = []
+        for unit in units:
+            parts.append(unit.text)
+            parts.append("\n\n" if unit.ends_paragraph else " ")
+        locations = sorted({unit.location for unit in units})
+        return Chunk(index, "".join(parts[:-1]), {location_key: locations})
+
+
+CHUNKERS = {
+    "page": PageChunker,
+    "sliding_window": SlidingWindowChunker,
+}
+
+
+def get_chunker(name=None):
+    """
+    Return a chunker instance for ``name`` (default ``settings.INGESTION_CHUNKER``).
+
+    ``name`` is either a key of ``CHUNKERS`` or a dotted path to a class with
+    a ``chunk(pages, location_key)`` method.
+    """
+    name = name or settings.INGESTION_CHUNKER
+    chunker_class = CHUNKERS.get(name) or import_string(name)
+    return chunker_class()
@@ -0,0 +1,71 @@
+from django.conf import settings
+
+from intune.openai_client import post_json
+from intune.tokens import count_tokens
+
+
+def iter_embedding_batches(chunks, max_items=None, max_tokens=None):
+    """
+    Group chunks into batches that each fit in one embeddings request.
+
+    Chunks are ``(chunk_index, text, ...)`` sequences such as ``Chunk``
+    tuples; extra items are passed through untouched.
+
+    A batch is closed as soon as the next chunk would take it past
+    ``max_items`` inputs or ``max_tokens`` estimated tokens. A chunk that is
+    over the token budget on its own is sent in a batch by itself.
+    """
+    max_items = max_items or settings.EMBEDDING_BATCH_SIZE
+    max_tokens = max_tokens or settings.EMBEDDING_BATCH_MAX_TOKENS
+
+    batch, batch_tokens = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk[1])
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+
+    if batch:
+        yield batch
+
+
+def embed_texts(texts, client=None):
+    """
+    Embed ``texts`` with a single multi-input embeddings request.
+
+    Returns the vectors in the same order as ``texts``. The request goes
+    through the shared rate limiter, retries and circuit breaker, and
+    raises ``OpenAIError`` if it ultimately fails. Pass an ``httpx.Client``
+    to use its connection pool instead of the process-wide one.
+    """
+    texts = list(texts)
+    json_data = {
+        "input": texts,
+        "model": settings.EMBEDDING_MODEL,
+        "encoding_format": "float",
+    }
+    data = post_json(
+        "embeddings",
+        json_data,
+        model=settings.EMBEDDING_MODEL,
+        tokens=sum(count_tokens(text) for text in texts),
+        client=client,
+    )
+
+    # Items carry the position of their input; don't rely on response order.
+    embeddings = [None] * len(texts)
+    for item in data["data"]:
+        embeddings[item["index"]] = item["embedding"]
+    return embeddings
+
+
+def embed_chunks(chunks, client=None):
+    """
+    Embed a batch of ``(chunk_index, text, ...)`` chunks.
+
+    Returns a ``{chunk_index: embedding}`` mapping.
+    """
+    embeddings = embed_texts([chunk[1] for chunk in chunks], client=client)
+    return {chunk[0]: embedding for chunk, embedding in zip(chunks, embeddings)}
@@ -0,0 +1,105 @@
+import hashlib
+import unicodedata
+
+import numpy as np
+import redis
+from django.conf import settings
+from django.db import DatabaseError
+
+from intune.cache import LRUCache, get_redis, pack_vector, unpack_vector
+from intune.models import CachedEmbedding
+
+REDIS_KEY_PREFIX = "embedding:"
+
+# Embeddings are kept as float32 arrays, 6 KB for 1536 dimensions instead
+# of about 49 KB as a list of Python floats.
+_local_cache = LRUCache(settings.EMBEDDING_CACHE_LOCAL_SIZE)
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def embedding_cache_key(text, model=None):
+    """Hash of the embedding model name plus the normalized text."""
+    model = model or settings.EMBEDDING_MODEL
+    digest = hashlib.sha256(f"{model}\n{normalize_text(text)}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_cached_embeddings(chunks):
+    """
+    Look up ``(chunk_index, text, ...)`` chunks in the embedding cache.
+
+    Returns ``{chunk_index: embedding}`` for the hits. The in-process and
+    Redis layers are consulted before Postgres. A layer that fails is
+    skipped, so the worst case is a miss and a normal API call.
+    """
+    keys = {chunk[0]: embedding_cache_key(chunk[1]) for chunk in chunks}
+    found = {}
+
+    for key in set(keys.values()):
+        embedding = _local_cache.get(key)
+        if embedding is not None:
+            found[key] = embedding
+
+    missing = [key for key in set(keys.values()) if key not in found]
+    if missing and settings.EMBEDDING_CACHE_REDIS:
+        try:
+            values = get_redis().mget([REDIS_KEY_PREFIX + key for key in missing])
+        except redis.RedisError as exc:
+            print(f"Embedding cache: Redis lookup failed: {exc}")
+        else:
+            for key, value in zip(missing, values):
+                if value is not None:
+                    found[key] = unpack_vector(value)
+                    _local_cache.set(key, found[key])
+
+    missing = [key for key in missing if key not in found]
+    if missing:
+        try:
+            rows = CachedEmbedding.objects.filter(key__in=missing).values_list(
+                "key", "embedding"
+            )
+            for key, embedding in rows:
+                found[key] = np.asarray(embedding, dtype=np.float32)
+                _local_cache.set(key, found[key])
+        except DatabaseError as exc:
+            print(f"Embedding cache: database lookup failed: {exc}")
+
+    return {
+        chunk_index: found[key] for chunk_index, key in keys.items() if key in found
+    }
+
+
+def cache_embeddings(chunks, embeddings):
+    """Store ``{chunk_index: embedding}`` for ``chunks`` in every cache layer."""
+    entries = {embedding_cache_key(chunk[1]): embeddings[chunk[0]] for chunk in chunks}
+    for key, embedding in entries.items():
+        _local_cache.set(key, np.asarray(embedding, dtype=np.float32))
+
+    if settings.EMBEDDING_CACHE_REDIS:
+        try:
+            pipeline = get_redis().pipeline(transaction=False)
+            for key, embedding in entries.items():
+                pipeline.set(
+                    REDIS_KEY_PREFIX + key,
+                    pack_vector(embedding),
+                    ex=settings.EMBEDDING_CACHE_REDIS_TTL,
+                )
+            pipeline.execute()
+        except redis.RedisError as exc:
+            print(f"Embedding cache: Redis write failed: {exc}")
+
+    try:
+        CachedEmbedding.objects.bulk_create(
+            [
+                CachedEmbedding(
+                    key=key, model=settings.EMBEDDING_MODEL, embedding=embedding
+                )
+                for key, embedding in entries.items()
+            ],
+            ignore_conflicts=True,
+        )
+    except DatabaseError as exc:
+        print(f"Embedding cache: database write failed: {exc}")
@@ -0,0 +1,123 @@
+import re
+from collections import deque
+
+import pymupdf
+from billiard.pool import Pool
+from django.conf import settings
+
+TEXT_CONTENT_TYPES = ["text/plain", "text/markdown", "text/md"]
+
+_MARKDOWN_HEADING_RE = re.compile(r"^#{1,6}\s")
+_MARKDOWN_FENCE_RE = re.compile(r"^(```|~~~)")
+
+
+def _extract_page_range(file_path, start, stop):
+    """Extract pages ``start`` to ``stop - 1`` (0-based) with a private handle."""
+    with pymupdf.open(file_path) as doc:
+        return [(n + 1, doc[n].get_text("text")) for n in range(start, stop)]
+
+
+def iter_pdf_pages(file_path, workers=None, pages_per_range=None):
+    """
+    Yield ``(page_number, text)`` for every page of a PDF, in page order.
+
+    Documents longer than one range are split into ranges of
+    ``pages_per_range`` pages that are extracted in parallel by ``workers``
+    processes, each opening its own ``pymupdf`` handle. Ranges are yielded
+    as soon as they and every range before them are done, and only a few
+    ranges per worker are in flight, so later stages start early and memory
+    stays bounded.
+
+    The processes come from billiard, Celery's fork of multiprocessing:
+    Celery's prefork children are daemonic, and the standard library
+    refuses to start processes from a daemonic process.
+    """
+    if workers is None:
+        workers = settings.PDF_EXTRACTION_WORKERS
+    pages_per_range = pages_per_range or settings.PDF_EXTRACTION_PAGES_PER_RANGE
+
+    with pymupdf.open(file_path) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count <= pages_per_range:
+            for page_number, page in enumerate(doc, start=1):
+                yield page_number, page.get_text("text")
+            return
+
+    ranges = iter(
+        (start, min(start + pages_per_range, page_count))
+        for start in range(0, page_count, pages_per_range)
+    )
+    with Pool(processes=workers) as pool:
+        pending = deque()
+
+        def submit_next_range():
+            page_range = next(ranges, None)
+            if page_range is not None:
+                pending.append(
+                    pool.apply_async(_extract_page_range, (file_path, *page_range))
+                )
+
+        for _ in range(workers * 2):
+            submit_next_range()
+
+        while pending:
+            pages = pending.popleft().get()
+            submit_next_range()
+            yield from pages
+
+
+def iter_text_sections(file_path, markdown=False, max_section_chars=None):
+    """
+    Yield ``(section_number, text)`` for a plain-text or markdown file.
+
+    The file is read incrementally. Markdown is split in front of every
+    heading outside fenced code blocks. Sections are also closed at the
+    first blank line after ``max_section_chars`` characters (or forcibly at
+    twice that), so memory stays bounded for huge files without headings.
+    """
+    max_section_chars = max_section_chars or settings.TEXT_SECTION_MAX_CHARS
+    section_number, lines, size, in_fence = 0, [], 0, False
+
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        # Read in bounded pieces so a single enormous line can't blow up memory.
+        for line in iter(lambda: f.readline(max_section_chars), ""):
+            if markdown:
+                if _MARKDOWN_FENCE_RE.match(line):
+                    in_fence = not in_fence
+                elif not in_fence and _MARKDOWN_HEADING_RE.match(line) and lines:
+                    section_number += 1
+                    yield section_number, "".join(lines)
+                    lines, size = [], 0
+
+            lines.append(line)
+            size += len(line)
+            if size >= max_section_chars and (
+                not line.strip() or size >= 2 * max_section_chars
+            ):
+                section_number += 1
+                yield section_number, "".join(lines)
+                lines, size = [], 0
+
+    if lines:
+        section_number += 1
+        yield section_number, "".join(lines)
+
+
+def iter_document_segments(document):
+    """
+    Return ``(segments, location_key)`` for a document: an iterator of
+    ``(number, text)`` pages or sections and the metadata key naming them.
+    Returns ``(None, None)`` for unsupported content types.
+    """
+    file_path = document.file.path
+
+    # PDF
+    if document.content_type == "application/pdf":
+        return iter_pdf_pages(file_path), "pages"
+
+    # TXT or MD
+    if document.content_type in TEXT_CONTENT_TYPES:
+        markdown = document.content_type != "text/plain"
+        return iter_text_sections(file_path, markdown=markdown), "sections"
+
+    return None, None
@@ -0,0 +1,138 @@
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from pgvector.psycopg import register_vector
+
+from intune.ingestion.embedding_cache import embedding_cache_key
+from intune.models import Document, DocumentChunk
+
+COPY_COLUMNS = (
+    "id",
+    "created_at",
+    "updated_at",
+    "document_id",
+    "team_id",
+    "chunk_index",
+    "text",
+    "embedding",
+    "metadata",
+    "content_hash",
+)
+COPY_TYPES = (
+    "uuid",
+    "timestamptz",
+    "timestamptz",
+    "uuid",
+    "uuid",
+    "int4",
+    "text",
+    "vector",
+    "jsonb",
+    "text",
+)
+
+
+def register_vector_types():
+    """
+    Teach the default connection the binary vector format (once per
+    connection). Cursors copy the adapters of their connection, so call this
+    before opening one.
+    """
+    connection.ensure_connection()
+    if connection.connection.adapters.types.get("vector") is None:
+        register_vector(connection.connection)
+
+
+class DocumentChunkWriter:
+    """
+    Buffer the chunks of one document and write them in large batches.
+
+    ``method`` is either ``"copy"`` (binary ``COPY ... FROM STDIN``) or
+    ``"bulk_create"``. Each flush runs in its own transaction, so a document
+    lands in ``len(chunks) / batch_size`` transactions instead of one per row.
+
+        with DocumentChunkWriter(document_id) as writer:
+            for chunk in chunks:
+                writer.add(chunk.index, chunk.text, embedding, chunk.metadata)
+    """
+
+    def __init__(self, document_id, team_id=None, batch_size=None, method=None):
+        self.document_id = document_id
+        # Chunks carry their document's team; look it up if not given.
+        self.team_id = team_id or (
+            Document.objects.values_list("team_id", flat=True).get(id=document_id)
+        )
+        self.batch_size = batch_size or settings.INGESTION_WRITE_BATCH_SIZE
+        self.method = method or settings.INGESTION_WRITE_METHOD
+        self.rows = []
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, chunk_index, text, embedding, metadata=None):
+        self.rows.append((chunk_index, text, embedding, metadata))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        with transaction.atomic():
+            if self.method == "copy":
+                self._copy(rows)
+            else:
+                self._bulk_create(rows)
+        self.written += len(rows)
+
+    def _bulk_create(self, rows):
+        DocumentChunk.objects.bulk_create(
+            [
+                DocumentChunk(
+                    document_id=self.document_id,
+                    team_id=self.team_id,
+                    chunk_index=chunk_index,
+                    text=text,
+                    embedding=embedding,
+                    metadata=metadata,
+                    content_hash=embedding_cache_key(text),
+                )
+                for chunk_index, text, embedding, metadata in rows
+            ],
+            batch_size=self.batch_size,
+        )
+
+    def _copy(self, rows):
+        now = timezone.now()
+        document_id = uuid.UUID(str(self.document_id))
+        team_id = uuid.UUID(str(self.team_id))
+        register_vector_types()
+        with connection.cursor() as cursor:
+            sql = (
+                f"COPY {DocumentChunk._meta.db_table} ({', '.join(COPY_COLUMNS)}) "
+                "FROM STDIN WITH (FORMAT BINARY)"
+            )
+            with cursor.cursor.copy(sql) as copy:
+                copy.set_types(COPY_TYPES)
+                for chunk_index, text, embedding, metadata in rows:
+                    copy.write_row(
+                        (
+                            uuid.uuid4(),
+                            now,
+                            now,
+                            document_id,
+                            team_id,
+                            chunk_index,
+                            text,
+                            embedding,
+                            metadata,
+                            embedding_cache_key(text),
+                        )
+                    )
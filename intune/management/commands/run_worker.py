@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from intune.celery import app
+
+
+class Command(BaseCommand):
+    help = (
+        "Start a Celery worker for one queue with the concurrency and prefetch "
+        "multiplier from CELERY_WORKER_PROFILES."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("queue", choices=sorted(settings.CELERY_WORKER_PROFILES))
+        parser.add_argument("--loglevel", default="info")
+        parser.add_argument(
+            "--concurrency", type=int, help="Override the profile's concurrency."
+        )
+
+    def handle(self, *args, **options):
+        queue = options["queue"]
+        profile = settings.CELERY_WORKER_PROFILES[queue]
+        concurrency = options["concurrency"] or profile["concurrency"]
+        if concurrency < 1:
+            raise CommandError("Concurrency must be at least 1.")
+
+        self.stdout.write(
+            f"Starting {queue} worker: concurrency {concurrency}, "
+            f"prefetch multiplier {profile['prefetch_multiplier']}"
+        )
+        app.worker_main(
+            [
+                "worker",
+                f"--queues={queue}",
+                f"--hostname={queue}@%h",
+                f"--concurrency={concurrency}",
+                f"--prefetch-multiplier={profile['prefetch_multiplier']}",
+                f"--loglevel={options['loglevel']}",
+            ]
+        )
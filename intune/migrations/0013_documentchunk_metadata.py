@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0012_chat_title"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="metadata",
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
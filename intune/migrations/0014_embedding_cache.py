@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:24
+
+import pgvector.django.vector
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0013_documentchunk_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedEmbedding",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("model", models.CharField(max_length=100)),
+                ("embedding", pgvector.django.vector.VectorField(dimensions=1536)),
+            ],
+            options={
+                "db_table": "embedding_cache",
+            },
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="embedding_cache_hits",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="embedding_cache_misses",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:25
+
+import hashlib
+import unicodedata
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def content_hash(text):
+    # Same as intune.ingestion.embedding_cache.embedding_cache_key().
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    key = f"{settings.EMBEDDING_MODEL}\n{normalized}".encode("utf-8")
+    return hashlib.sha256(key).hexdigest()
+
+
+def backfill_content_hashes(apps, schema_editor):
+    DocumentChunk = apps.get_model("intune", "DocumentChunk")
+    chunks = DocumentChunk.objects.only("id", "text").order_by("id")
+    batch = []
+    for chunk in chunks.iterator(chunk_size=1000):
+        chunk.content_hash = content_hash(chunk.text)
+        batch.append(chunk)
+        if len(batch) >= 1000:
+            DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0014_embedding_cache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="version",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="documentchunk",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:27
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def mark_existing_documents_completed(apps, schema_editor):
+    # Documents uploaded before status tracking were already ingested.
+    Document = apps.get_model("intune", "Document")
+    for document in Document.objects.annotate(num_chunks=Count("chunks")):
+        document.status = "completed"
+        document.is_searchable = True
+        document.chunk_count = document.num_chunks
+        document.save(update_fields=["status", "is_searchable", "chunk_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0015_document_versioning"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="chunk_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="error",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="is_searchable",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="processing_completed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="processing_started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="stage_timings",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="document",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=16,
+            ),
+        ),
+        migrations.RunPython(
+            mark_existing_documents_completed, migrations.RunPython.noop
+        ),
+    ]
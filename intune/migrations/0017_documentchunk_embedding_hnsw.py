@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:35
+
+import pgvector.django.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction; building it
+    # this way keeps document_chunks writable while the index is built.
+    atomic = False
+
+    dependencies = [
+        ("intune", "0016_document_ingestion_status"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="documentchunk",
+            index=pgvector.django.indexes.HnswIndex(
+                ef_construction=64,
+                fields=["embedding"],
+                m=16,
+                name="document_chunks_embedding_hnsw",
+                opclasses=["vector_cosine_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0017_documentchunk_embedding_hnsw"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="team",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="intune.team",
+            ),
+        ),
+        # One set-based UPDATE rather than saving chunks one by one.
+        migrations.RunSQL(
+            sql="""
+                UPDATE document_chunks
+                SET team_id = documents.team_id
+                FROM documents
+                WHERE documents.id = document_chunks.document_id
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AlterField(
+            model_name="documentchunk",
+            name="team",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="intune.team",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="documentchunk",
+            index=models.Index(
+                fields=["team", "document"], name="document_chunks_team_doc_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:31
+
+from django.db import migrations
+
+# Rebuild document_chunks as a table LIST-partitioned by team_id, with one
+# partition per team (document_chunks_<team id hex>) and a default partition
+# for rows of teams that don't have one yet. Postgres can't partition an
+# existing table in place, so the rows are copied into the new table. The
+# primary key of a partitioned table must include the partition key, so it
+# becomes (id, team_id); ids stay unique UUIDs and the ORM still uses id.
+PARTITION_DOCUMENT_CHUNKS = """
+CREATE TABLE document_chunks_partitioned (
+    LIKE document_chunks INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY LIST (team_id);
+
+CREATE TABLE document_chunks_default
+    PARTITION OF document_chunks_partitioned DEFAULT;
+
+DO $$
+DECLARE
+    team_id uuid;
+BEGIN
+    FOR team_id IN SELECT id FROM teams LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF document_chunks_partitioned FOR VALUES IN (%L)',
+            'document_chunks_' || replace(team_id::text, '-', ''),
+            team_id
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO document_chunks_partitioned SELECT * FROM document_chunks;
+DROP TABLE document_chunks;
+ALTER TABLE document_chunks_partitioned RENAME TO document_chunks;
+
+ALTER TABLE document_chunks
+    ADD CONSTRAINT document_chunks_pkey PRIMARY KEY (id, team_id);
+ALTER TABLE document_chunks
+    ADD CONSTRAINT document_chunks_document_id_c7107238_fk_documents_id
+    FOREIGN KEY (document_id) REFERENCES documents (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE document_chunks
+    ADD CONSTRAINT document_chunks_team_id_a0424e47_fk_teams_id
+    FOREIGN KEY (team_id) REFERENCES teams (id) DEFERRABLE INITIALLY DEFERRED;
+
+-- Indexes on the parent are created on every partition, so each team gets
+-- its own, much smaller HNSW graph.
+CREATE INDEX document_chunks_document_id_c7107238
+    ON document_chunks (document_id);
+CREATE INDEX document_chunks_team_doc_idx
+    ON document_chunks (team_id, document_id);
+CREATE INDEX document_chunks_embedding_hnsw
+    ON document_chunks USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+ANALYZE document_chunks;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0018_documentchunk_team"),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_DOCUMENT_CHUNKS),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:43
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0019_partition_document_chunks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="search_vector",
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=django.contrib.postgres.search.SearchVector(
+                    "text", config="english"
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="documentchunk",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="document_chunks_search_gin"
+            ),
+        ),
+    ]
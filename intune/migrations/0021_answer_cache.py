@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-18 04:45
+
+import django.db.models.deletion
+import pgvector.django.vector
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0020_documentchunk_search_vector"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="team",
+            name="documents_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="CachedAnswer",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("documents_version", models.PositiveIntegerField()),
+                ("query", models.TextField()),
+                (
+                    "query_embedding",
+                    pgvector.django.vector.VectorField(dimensions=1536),
+                ),
+                ("chunk_ids", models.JSONField(default=list)),
+                ("answer", models.TextField()),
+                ("hits", models.PositiveIntegerField(default=0)),
+                (
+                    "team",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="cached_answers",
+                        to="intune.team",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "answer_cache",
+                "indexes": [
+                    models.Index(
+                        fields=["team", "documents_version"],
+                        name="answer_cache_team_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 05:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("intune", "0021_answer_cache"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chat",
+            name="summarized_until",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="chat",
+            name="summary",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -2,6 +2,8 @@ from intune.models.user import User
 from intune.models.team import Team, TeamMember
 from intune.models.document import Document, DocumentChunk
 from intune.models.chat import Chat, ChatConversation
+from intune.models.embedding import CachedEmbedding
+from intune.models.answer import CachedAnswer
 
 __all__ = [
     "User",
@@ -11,4 +13,6 @@ __all__ = [
     "DocumentChunk",
     "Chat",
     "ChatConversation",
+    "CachedEmbedding",
+    "CachedAnswer",
 ]
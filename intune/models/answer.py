@@ -0,0 +1,29 @@
+from django.db import models
+from pgvector.django import VectorField
+
+from intune.models.base import BaseModel
+
+
+class CachedAnswer(BaseModel):
+    """
+    An answer to a team question, reused for near-duplicate questions while
+    the team's documents are unchanged (see ``Team.documents_version``).
+    """
+
+    team = models.ForeignKey(
+        "Team", on_delete=models.CASCADE, related_name="cached_answers"
+    )
+    documents_version = models.PositiveIntegerField()
+    query = models.TextField()
+    query_embedding = VectorField(dimensions=1536)
+    chunk_ids = models.JSONField(default=list)
+    answer = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "answer_cache"
+        indexes = [
+            models.Index(
+                fields=["team", "documents_version"], name="answer_cache_team_idx"
+            ),
+        ]
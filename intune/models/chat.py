@@ -7,6 +7,10 @@ class Chat(BaseModel):
     team = models.ForeignKey("Team", on_delete=models.CASCADE, related_name="chats")
     user = models.ForeignKey("User", on_delete=models.CASCADE, related_name="chats")
     is_conversation_active = models.BooleanField(default=False)
+    # Rolling summary of the conversation up to and including the message
+    # created at summarized_until, kept by the summarize_chat task.
+    summary = models.TextField(blank=True, default="")
+    summarized_until = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = "chats"
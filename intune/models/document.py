@@ -1,20 +1,128 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 from intune.models.base import BaseModel
-from pgvector.django import VectorField
+from intune.models.team import Team
+from pgvector.django import HnswIndex, VectorField
 
 
 class Document(BaseModel):
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
     team = models.ForeignKey("Team", on_delete=models.CASCADE, related_name="documents")
     name = models.CharField(max_length=255)
     file = models.FileField(upload_to="documents/")
     metadata = models.JSONField(blank=True, null=True)
     size = models.BigIntegerField(blank=True, null=True)
     content_type = models.CharField(max_length=100, blank=True, null=True)
+    version = models.IntegerField(default=1)
+    embedding_cache_hits = models.IntegerField(default=0)
+    embedding_cache_misses = models.IntegerField(default=0)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="pending")
+    # Only searchable documents are used for retrieval.
+    is_searchable = models.BooleanField(default=False)
+    chunk_count = models.IntegerField(default=0)
+    # Seconds spent per ingestion stage: extract, chunk, embed, persist, total.
+    stage_timings = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True, default="")
+    processing_started_at = models.DateTimeField(blank=True, null=True)
+    processing_completed_at = models.DateTimeField(blank=True, null=True)
+
+    # Saved by the mark_*() methods; the cache counters are updated with F()
+    # expressions by concurrent tasks and must not be overwritten.
+    STATUS_FIELDS = [
+        "status",
+        "is_searchable",
+        "chunk_count",
+        "stage_timings",
+        "error",
+        "processing_started_at",
+        "processing_completed_at",
+        "updated_at",
+    ]
 
     class Meta:
         db_table = "documents"
 
+    @property
+    def ordered_stage_timings(self):
+        """``(stage, seconds)`` pairs in pipeline order, for display."""
+        timings = self.stage_timings or {}
+        stages = ["extract", "chunk", "embed", "persist", "total"]
+        return [(stage, timings[stage]) for stage in stages if stage in timings]
+
+    def start_new_version(self, uploaded_file):
+        # The previous chunks stay searchable until the new version is
+        # ingested, so ``is_searchable`` and ``chunk_count`` are kept.
+        self.file = uploaded_file
+        self.size = uploaded_file.size
+        self.content_type = uploaded_file.content_type
+        self.version += 1
+        self.status = "pending"
+        self.error = ""
+        self.stage_timings = None
+        self.processing_started_at = None
+        self.processing_completed_at = None
+        self.embedding_cache_hits = 0
+        self.embedding_cache_misses = 0
+        self.save(
+            update_fields=[
+                "file",
+                "size",
+                "content_type",
+                "version",
+                "status",
+                "error",
+                "stage_timings",
+                "processing_started_at",
+                "processing_completed_at",
+                "embedding_cache_hits",
+                "embedding_cache_misses",
+                "updated_at",
+            ]
+        )
+
+    def mark_processing(self):
+        self.status = "processing"
+        self.error = ""
+        self.stage_timings = None
+        self.processing_started_at = timezone.now()
+        self.processing_completed_at = None
+        self.save(update_fields=self.STATUS_FIELDS)
+
+    def mark_completed(self, chunk_count, stage_timings):
+        self.status = "completed"
+        self.is_searchable = True
+        self.chunk_count = chunk_count
+        self.stage_timings = stage_timings
+        self.processing_completed_at = timezone.now()
+        self.save(update_fields=self.STATUS_FIELDS)
+        Team.documents_changed(self.team_id)
+
+    def mark_failed(self, error, stage_timings=None):
+        # A failed re-ingestion leaves the previous chunks searchable.
+        self.status = "failed"
+        self.error = error
+        self.stage_timings = stage_timings
+        self.processing_completed_at = timezone.now()
+        self.save(update_fields=self.STATUS_FIELDS)
+        # Chunks may have been replaced before the failure.
+        Team.documents_changed(self.team_id)
+
+    @property
+    def embedding_cache_hit_ratio(self):
+        total = self.embedding_cache_hits + self.embedding_cache_misses
+        if not total:
+            return None
+        return self.embedding_cache_hits / total
+
     def html_document_link(self):
         return f'<a href="{self.file.url}" target="_blank">{self.name}</a>'
 
@@ -23,9 +131,40 @@ class DocumentChunk(BaseModel):
     document = models.ForeignKey(
         "Document", on_delete=models.CASCADE, related_name="chunks"
     )
+    # Copy of document.team_id so vector search filters this table alone.
+    team = models.ForeignKey(
+        "Team", on_delete=models.CASCADE, related_name="chunks", db_index=False
+    )
     chunk_index = models.IntegerField()
     text = models.TextField()
     embedding = VectorField(dimensions=1536)
+    metadata = models.JSONField(blank=True, null=True)
+    # Model-qualified hash of the normalized text, see embedding_cache_key().
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # Maintained by Postgres from text; used for keyword search.
+    search_vector = models.GeneratedField(
+        expression=SearchVector("text", config="english"),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     class Meta:
+        # LIST-partitioned by team_id with one partition per team, managed by
+        # intune.partitions. The primary key in the database is (id, team_id).
         db_table = "document_chunks"
+        indexes = [
+            # Exact searches of small teams read the team's rows through this.
+            models.Index(
+                fields=["team", "document"], name="document_chunks_team_doc_idx"
+            ),
+            GinIndex(fields=["search_vector"], name="document_chunks_search_gin"),
+            # Changing the build parameters needs a new migration; the
+            # VECTOR_INDEX_* settings only apply to the benchmark.
+            HnswIndex(
+                name="document_chunks_embedding_hnsw",
+                fields=["embedding"],
+                m=16,
+                ef_construction=64,
+                opclasses=["vector_cosine_ops"],
+            ),
+        ]
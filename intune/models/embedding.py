@@ -0,0 +1,15 @@
+from django.db import models
+from pgvector.django import VectorField
+
+from intune.models.base import BaseModel
+
+
+class CachedEmbedding(BaseModel):
+    """An embedding keyed by model name and a hash of the normalized text."""
+
+    key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=100)
+    embedding = VectorField(dimensions=1536)
+
+    class Meta:
+        db_table = "embedding_cache"
@@ -1,5 +1,7 @@
 from django.db import models
+from django.db.models import F
 
+from intune.models.answer import CachedAnswer
 from intune.models.base import BaseModel
 
 
@@ -9,10 +11,23 @@ class Team(BaseModel):
     created_by = models.ForeignKey(
         "User", on_delete=models.SET_NULL, null=True, related_name="created_teams"
     )
+    # Bumped whenever the team's searchable chunks change.
+    documents_version = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = "teams"
 
+    @classmethod
+    def documents_changed(cls, team_id):
+        """
+        Record that the searchable chunks of a team changed: bump its
+        documents_version and drop the answers cached for the old chunks.
+        """
+        cls.objects.filter(id=team_id).update(
+            documents_version=F("documents_version") + 1
+        )
+        CachedAnswer.objects.filter(team_id=team_id).delete()
+
 
 class TeamMember(BaseModel):
     ROLE_CHOICES = [
@@ -0,0 +1,274 @@
+"""
+Shared entry point for every OpenAI API call.
+
+Requests go through a Redis token bucket (requests/min and tokens/min per
+model) shared by all web and Celery processes, are retried with jittered
+exponential backoff that honours ``Retry-After``, and fail fast while a
+cluster-wide circuit breaker is open after repeated upstream failures.
+"""
+
+import json
+import random
+import time
+
+import httpx
+import redis
+from django.conf import settings
+
+from intune.cache import get_redis
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+CIRCUIT_FAILURES_KEY = "openai:circuit:failures"
+CIRCUIT_OPEN_KEY = "openai:circuit:open"
+
+# Takes tokens from the requests and tokens buckets of a model, both or
+# neither. Returns 0 when granted, otherwise the seconds to wait.
+# KEYS: requests bucket, tokens bucket
+# ARGV: requests/min, tokens/min, tokens requested
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local wait = 0
+local levels = {}
+local wanted = {1, tonumber(ARGV[3])}
+for i = 1, 2 do
+    local capacity = tonumber(ARGV[i])
+    local rate = capacity / 60
+    local want = math.min(wanted[i], capacity)
+    local bucket = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + (now - ts) * rate)
+    levels[i] = level - want
+    if level < want then
+        wait = math.max(wait, (want - level) / rate)
+    end
+end
+if wait == 0 then
+    for i = 1, 2 do
+        redis.call('HSET', KEYS[i], 'level', levels[i], 'ts', now)
+        redis.call('EXPIRE', KEYS[i], 120)
+    end
+end
+return tostring(wait)
+"""
+
+
+class OpenAIError(Exception):
+    """An OpenAI request failed and was not (or no longer) worth retrying."""
+
+
+class RateLimitTimeout(OpenAIError):
+    """The shared rate limiter did not grant capacity in time."""
+
+
+class CircuitOpenError(OpenAIError):
+    """The upstream is failing; requests are rejected without being sent."""
+
+
+_client = None
+_token_bucket = None
+
+
+def client_options():
+    return {
+        "http2": settings.OPENAI_HTTP2,
+        "limits": httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def get_client():
+    """Return the process-wide ``httpx.Client`` (keep-alive connection pool)."""
+    global _client
+    if _client is None:
+        _client = httpx.Client(**client_options())
+    return _client
+
+
+def acquire(model, tokens):
+    """
+    Block until the shared limiter grants one request and ``tokens`` tokens
+    for ``model``. Models without configured limits are not limited, and the
+    limiter fails open if Redis is unreachable.
+    """
+    global _token_bucket
+    limits = settings.OPENAI_RATE_LIMITS.get(model)
+    if not settings.OPENAI_RATE_LIMIT_ENABLED or not limits:
+        return
+
+    deadline = time.monotonic() + settings.OPENAI_RATE_LIMIT_MAX_WAIT
+    keys = [f"openai:ratelimit:{model}:requests", f"openai:ratelimit:{model}:tokens"]
+    args = [limits["requests_per_minute"], limits["tokens_per_minute"], tokens]
+    while True:
+        try:
+            if _token_bucket is None:
+                _token_bucket = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+            wait = float(_token_bucket(keys=keys, args=args))
+        except redis.RedisError as exc:
+            print(f"Rate limiter unavailable, continuing without it: {exc}")
+            return
+        if wait == 0:
+            return
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"Rate limit for {model} not granted in time")
+        time.sleep(wait + random.uniform(0, 0.05))
+
+
+def _check_circuit():
+    try:
+        is_open = get_redis().exists(CIRCUIT_OPEN_KEY)
+    except redis.RedisError:
+        return
+    if is_open:
+        raise CircuitOpenError("OpenAI circuit breaker is open")
+
+
+def _record_failure():
+    try:
+        pipeline = get_redis().pipeline()
+        pipeline.incr(CIRCUIT_FAILURES_KEY)
+        pipeline.expire(CIRCUIT_FAILURES_KEY, settings.OPENAI_CIRCUIT_WINDOW)
+        failures = pipeline.execute()[0]
+        if failures >= settings.OPENAI_CIRCUIT_THRESHOLD:
+            get_redis().set(CIRCUIT_OPEN_KEY, 1, ex=settings.OPENAI_CIRCUIT_COOLDOWN)
+            print(f"OpenAI circuit breaker opened after {failures} failures")
+    except redis.RedisError:
+        pass
+
+
+def _record_success():
+    try:
+        get_redis().delete(CIRCUIT_FAILURES_KEY)
+    except redis.RedisError:
+        pass
+
+
+def _retry_after(response):
+    """Seconds the server asked us to wait, if it said so."""
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        value = response.headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+def _backoff(attempt, response=None):
+    retry_after = _retry_after(response)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.25)
+    # Full jitter: random point in an exponentially growing window.
+    window = min(settings.OPENAI_RETRY_MAX_DELAY, 0.5 * 2**attempt)
+    return random.uniform(0, window)
+
+
+def _before_request(model, tokens):
+    _check_circuit()
+    acquire(model, tokens)
+
+
+def _retry_delay(path, attempt, response, error):
+    """
+    Account for a failed attempt and return the seconds to wait before the
+    next one, or raise ``OpenAIError`` if there shouldn't be one.
+    """
+    if response is not None and response.status_code not in RETRYABLE_STATUS_CODES:
+        raise OpenAIError(error)
+    # Throttling means the upstream is healthy, so it doesn't count
+    # towards opening the circuit.
+    if response is None or response.status_code >= 500:
+        _record_failure()
+    if attempt == settings.OPENAI_MAX_RETRIES:
+        raise OpenAIError(f"OpenAI request to {path} failed after retries: {error}")
+    delay = _backoff(attempt, response)
+    print(f"OpenAI request to {path} failed ({error}); retrying in {delay:.1f}s")
+    return delay
+
+
+def _request_headers():
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+    }
+
+
+def post_json(path, payload, model, tokens, timeout=60.0, client=None):
+    """
+    POST ``payload`` to ``{OPENAI_API_BASE}/{path}`` and return the decoded
+    JSON body. Raises ``OpenAIError`` once retries are exhausted or the
+    error is not retryable.
+    """
+    client = client or get_client()
+    url = f"{settings.OPENAI_API_BASE}/{path}"
+
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        _before_request(model, tokens)
+
+        response, error = None, None
+        try:
+            response = client.post(
+                url, headers=_request_headers(), json=payload, timeout=timeout
+            )
+        except httpx.TransportError as exc:
+            error = f"{type(exc).__name__}: {exc}"
+        else:
+            if response.status_code == 200:
+                _record_success()
+                return response.json()
+            error = f"HTTP {response.status_code}: {response.text[:500]}"
+
+        time.sleep(_retry_delay(path, attempt, response, error))
+
+
+def stream_chat_completion(payload, tokens, timeout=60.0, client=None):
+    """
+    Start a streamed chat completion of ``payload`` and yield the text of
+    the answer as it arrives.
+
+    Failures before the first byte of the answer are retried like
+    ``post_json``. Once text has been yielded it can't be taken back, so
+    later failures raise ``OpenAIError`` straight away.
+    """
+    client = client or get_client()
+    path = "chat/completions"
+    url = f"{settings.OPENAI_API_BASE}/{path}"
+    payload = {**payload, "stream": True}
+
+    for attempt in range(settings.OPENAI_MAX_RETRIES + 1):
+        _before_request(payload["model"], tokens)
+
+        response, error = None, None
+        try:
+            with client.stream(
+                "POST", url, headers=_request_headers(), json=payload, timeout=timeout
+            ) as response:
+                if response.status_code == 200:
+                    _record_success()
+                    # Server-sent events: "data: {chunk}" lines, then
+                    # "data: [DONE]". The body is read to its end so the
+                    # connection goes back to the pool.
+                    for line in response.iter_lines():
+                        if not line.startswith("data: ") or line == "data: [DONE]":
+                            continue
+                        choices = json.loads(line[len("data: ") :])["choices"]
+                        text = choices[0]["delta"].get("content") if choices else None
+                        if text:
+                            yield text
+                    return
+                response.read()
+                error = f"HTTP {response.status_code}: {response.text[:500]}"
+        except httpx.TransportError as exc:
+            if response is not None and response.status_code == 200:
+                raise OpenAIError(f"OpenAI stream broke off: {exc}") from exc
+            error = f"{type(exc).__name__}: {exc}"
+
+        time.sleep(_retry_delay(path, attempt, response, error))
@@ -0,0 +1,54 @@
+"""
+Management of the per-team partitions of ``document_chunks``.
+
+The table is LIST-partitioned by ``team_id`` (see migration 0019). Every
+team gets its own partition when it's created, and deleting a team drops
+its partition instead of deleting its chunks row by row.
+"""
+
+import uuid
+
+from django.db import connection
+
+PARENT_TABLE = "document_chunks"
+
+
+def chunk_partition_name(team_id):
+    return f"{PARENT_TABLE}_{uuid.UUID(str(team_id)).hex}"
+
+
+def create_chunk_partition(team_id):
+    """
+    Create and attach the partition for ``team_id``, if it doesn't exist.
+
+    The table is created on its own and then attached, which only takes a
+    SHARE UPDATE EXCLUSIVE lock on document_chunks, so searches and
+    ingestion of other teams carry on. Attaching builds the partition's
+    copies of the parent's indexes.
+    """
+    team_id = uuid.UUID(str(team_id))
+    name = chunk_partition_name(team_id)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f'CREATE TABLE "{name}" (LIKE {PARENT_TABLE} '
+            "INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)"
+        )
+        # Partition bounds can't be query parameters; team_id is a UUID.
+        cursor.execute(
+            f'ALTER TABLE {PARENT_TABLE} ATTACH PARTITION "{name}" '
+            f"FOR VALUES IN ('{team_id}')"
+        )
+
+
+def drop_chunk_partition(team_id):
+    """Detach and drop the partition of ``team_id`` with all its chunks."""
+    name = chunk_partition_name(team_id)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"')
+        cursor.execute(f'DROP TABLE "{name}"')
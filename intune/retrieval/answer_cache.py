@@ -0,0 +1,63 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from pgvector.django import CosineDistance
+
+from intune.models import CachedAnswer, DocumentChunk
+
+
+def find_cached_answer(team, query_embedding, documents_version):
+    """
+    Return the cached answer of ``team`` whose question is most similar to
+    ``query_embedding``, or None if none is at least
+    ANSWER_CACHE_SIMILARITY similar.
+
+    Only answers built from the current ``documents_version`` whose chunks
+    all still exist are reused, so a changed document never serves a stale
+    answer.
+    """
+    if not settings.ANSWER_CACHE_ENABLED or query_embedding is None:
+        return None
+
+    max_distance = 1 - settings.ANSWER_CACHE_SIMILARITY
+    fresh_since = timezone.now() - timedelta(seconds=settings.ANSWER_CACHE_TTL)
+    cached = (
+        CachedAnswer.objects.filter(
+            team=team,
+            documents_version=documents_version,
+            created_at__gte=fresh_since,
+        )
+        .annotate(distance=CosineDistance("query_embedding", query_embedding))
+        .filter(distance__lte=max_distance)
+        .order_by("distance")
+        .first()
+    )
+    if cached is None:
+        return None
+
+    live_chunks = DocumentChunk.objects.filter(team=team, id__in=cached.chunk_ids)
+    if live_chunks.count() != len(cached.chunk_ids):
+        cached.delete()
+        return None
+
+    CachedAnswer.objects.filter(id=cached.id).update(hits=F("hits") + 1)
+    print(
+        f"Answer cache hit for team {team.id} (distance {cached.distance:.4f}): {cached.query!r}"
+    )
+    return cached
+
+
+def cache_answer(team, documents_version, query, query_embedding, chunks, answer):
+    """Store ``answer`` to ``query``, built from ``chunks`` of ``documents_version``."""
+    if not settings.ANSWER_CACHE_ENABLED or query_embedding is None:
+        return
+    CachedAnswer.objects.create(
+        team=team,
+        documents_version=documents_version,
+        query=query,
+        query_embedding=query_embedding,
+        chunk_ids=[str(chunk.id) for chunk in chunks],
+        answer=answer,
+    )
@@ -0,0 +1,144 @@
+import re
+
+from django.conf import settings
+from django.utils.html import strip_tags
+
+from intune.tokens import count_tokens, truncate_to_tokens
+
+# Snippets shorter than this after truncation aren't worth their header.
+MIN_SNIPPET_TOKENS = 50
+
+# Answers end with "<hr/>" and a block of source links, see the prompts in
+# intune/answering.py.
+SOURCES_DIVIDER = re.compile(r"<hr\s*/?>", re.IGNORECASE)
+
+
+def format_snippet(number, chunk, text, estimate_confidence=False):
+    header = (
+        f"[Snippet {number}] doc {chunk.document.id} chunk {chunk.chunk_index} "
+        f"distance {chunk.distance:.3f}"
+    )
+    if estimate_confidence:
+        # smaller distance -> higher confidence. Clamp to 0..100.
+        confidence = int(max(0, min(100, round(100 - chunk.distance * 100))))
+        header += f" confidence {confidence}"
+    return f"{header}\nlink: {chunk.document.html_document_link()}\n{text}"
+
+
+def pack_snippets(
+    chunks,
+    budget=None,
+    max_distance=None,
+    estimate_confidence=False,
+    single_line=False,
+):
+    """
+    Format retrieved ``chunks`` (best first, from ``search_chunks``) as the
+    snippets block of an answer prompt, within ``budget`` tokens
+    (PROMPT_SNIPPET_TOKENS).
+
+    Chunks further than ``max_distance`` (PROMPT_MAX_DISTANCE) from the
+    question are dropped. The rest are added in rank order until the
+    budget runs out; the first one that doesn't fit is truncated to the
+    remaining budget and ends the block, so lower-ranked chunks never
+    displace higher-ranked ones.
+
+    ``estimate_confidence`` adds a confidence derived from the distance for
+    the model to start from; ``single_line`` joins each text into one line
+    to avoid accidental paragraph breaks in the answer.
+
+    Returns the block and the chunks it includes.
+    """
+    budget = settings.PROMPT_SNIPPET_TOKENS if budget is None else budget
+    if max_distance is None:
+        max_distance = settings.PROMPT_MAX_DISTANCE
+
+    snippets, packed = [], []
+    for chunk in chunks:
+        if chunk.distance > max_distance:
+            continue
+        text = chunk.text.strip()
+        if single_line:
+            text = " ".join(text.splitlines())
+        snippet = format_snippet(len(packed) + 1, chunk, text, estimate_confidence)
+        tokens = count_tokens(snippet)
+        if tokens > budget:
+            header_tokens = tokens - count_tokens(text)
+            if budget - header_tokens >= MIN_SNIPPET_TOKENS:
+                text = truncate_to_tokens(text, budget - header_tokens)
+                snippets.append(
+                    format_snippet(len(packed) + 1, chunk, text, estimate_confidence)
+                )
+                packed.append(chunk)
+            break
+        snippets.append(snippet)
+        packed.append(chunk)
+        budget -= tokens
+
+    return "\n\n".join(snippets), packed
+
+
+def conversation_line(conv):
+    """
+    A chat message as a single "User: ..." / "Bot: ..." line. Answers lose
+    their sources block and HTML, which only cost tokens in later prompts.
+    """
+    speaker = "User" if conv.sender == "user" else "Bot"
+    message = conv.message
+    if conv.sender == "bot":
+        message = strip_tags(SOURCES_DIVIDER.split(message, 1)[0])
+    # keep single-line entries to avoid introducing unintended line breaks
+    return f"{speaker}: {' '.join(message.split())}"
+
+
+def pack_history(conversations, budget=None):
+    """
+    Format ``conversations`` (oldest first) as ``conversation_line``s,
+    keeping the newest that fit in ``budget`` tokens
+    (PROMPT_HISTORY_TOKENS). The newest message is truncated if it alone
+    is over the budget.
+    """
+    budget = settings.PROMPT_HISTORY_TOKENS if budget is None else budget
+    lines = []
+    for conv in reversed(conversations):
+        line = conversation_line(conv)
+        tokens = count_tokens(line)
+        if tokens > budget:
+            if not lines:
+                lines.append(truncate_to_tokens(line, budget))
+            break
+        lines.append(line)
+        budget -= tokens
+    return "".join(f"{line}\n" for line in reversed(lines))
+
+
+def history_batches(conversations, budget=None):
+    """
+    Split ``conversations`` (oldest first) into consecutive batches that
+    ``pack_history`` keeps whole within ``budget`` tokens
+    (PROMPT_HISTORY_TOKENS). A message over the budget is a batch of its
+    own, truncated when packed.
+    """
+    budget = settings.PROMPT_HISTORY_TOKENS if budget is None else budget
+    batch, tokens = [], 0
+    for conv in conversations:
+        line_tokens = count_tokens(conversation_line(conv))
+        if batch and tokens + line_tokens > budget:
+            yield batch
+            batch, tokens = [], 0
+        batch.append(conv)
+        tokens += line_tokens
+    if batch:
+        yield batch
+
+
+def prompt_token_counts(prompt, **sections):
+    """
+    Estimated tokens per named section of ``prompt``, plus its
+    ``instructions`` (everything else) and ``total``, for logging.
+    """
+    counts = {name: count_tokens(text) for name, text in sections.items()}
+    total = count_tokens(prompt)
+    counts["instructions"] = total - sum(counts.values())
+    counts["total"] = total
+    return counts
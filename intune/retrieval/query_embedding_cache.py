@@ -0,0 +1,60 @@
+import hashlib
+
+import numpy as np
+import redis
+from django.conf import settings
+
+from intune.cache import LRUCache, get_redis, pack_vector, unpack_vector
+from intune.ingestion.embedding_cache import normalize_text
+
+REDIS_KEY_PREFIX = "query-embedding:"
+
+# Embeddings are kept as float32 arrays, like the ingestion cache's.
+_local_cache = LRUCache(settings.QUERY_EMBEDDING_CACHE_LOCAL_SIZE)
+
+
+def query_cache_key(query, model=None):
+    """
+    Hash of the embedding model name plus the normalized query. Queries are
+    also case-folded: "What is the PTO policy" and "what is the pto policy"
+    share an entry.
+    """
+    model = model or settings.EMBEDDING_MODEL
+    text = normalize_text(query).casefold()
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+def get_cached_query_embedding(query):
+    """
+    Return the cached embedding of ``query`` as a float32 array, or None.
+    The in-process LRU is checked before Redis; a Redis failure counts as a
+    miss.
+    """
+    key = query_cache_key(query)
+    embedding = _local_cache.get(key)
+    if embedding is not None:
+        return embedding
+
+    try:
+        value = get_redis().get(REDIS_KEY_PREFIX + key)
+    except redis.RedisError as exc:
+        print(f"Query embedding cache: Redis lookup failed: {exc}")
+        return None
+    if value is None:
+        return None
+    embedding = unpack_vector(value)
+    _local_cache.set(key, embedding)
+    return embedding
+
+
+def cache_query_embedding(query, embedding):
+    key = query_cache_key(query)
+    _local_cache.set(key, np.asarray(embedding, dtype=np.float32))
+    try:
+        get_redis().set(
+            REDIS_KEY_PREFIX + key,
+            pack_vector(embedding),
+            ex=settings.QUERY_EMBEDDING_CACHE_TTL,
+        )
+    except redis.RedisError as exc:
+        print(f"Query embedding cache: Redis write failed: {exc}")
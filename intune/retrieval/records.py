@@ -0,0 +1,59 @@
+from django.core.files.storage import default_storage
+
+
+class DocumentRecord:
+    """The columns of a ``Document`` that answer prompts use."""
+
+    __slots__ = ("id", "name", "file", "content_type", "size", "created_at")
+
+    def __init__(self, id, name, file, content_type, size, created_at):
+        self.id = id
+        self.name = name
+        # The stored file name, as in Document.file.name.
+        self.file = file
+        self.content_type = content_type
+        self.size = size
+        self.created_at = created_at
+
+    def html_document_link(self):
+        url = default_storage.url(self.file)
+        return f'<a href="{url}" target="_blank">{self.name}</a>'
+
+
+class ChunkRecord:
+    """
+    A retrieved chunk: the columns of a ``DocumentChunk`` that answer
+    prompts use, its ``distance`` to the query and, for hybrid searches,
+    its fused ``score``. ``similarities``, its cosine similarity to each of
+    the retrieved chunks in order, is only loaded for re-ranking.
+    """
+
+    __slots__ = (
+        "id",
+        "document_id",
+        "chunk_index",
+        "text",
+        "distance",
+        "score",
+        "similarities",
+        "document",
+    )
+
+    def __init__(
+        self,
+        id,
+        document_id,
+        chunk_index,
+        text,
+        distance=None,
+        score=None,
+        similarities=None,
+    ):
+        self.id = id
+        self.document_id = document_id
+        self.chunk_index = chunk_index
+        self.text = text
+        self.distance = distance
+        self.score = score
+        self.similarities = similarities
+        self.document = None
@@ -0,0 +1,82 @@
+import numpy as np
+from django.conf import settings
+
+
+def mmr_select(
+    relevance,
+    similarities,
+    k,
+    weight=None,
+    groups=None,
+    max_per_group=None,
+):
+    """
+    Pick ``k`` candidates by maximal marginal relevance and return their
+    positions, in pick order.
+
+    ``relevance`` scores each candidate against the query and
+    ``similarities`` is the matrix of their pairwise cosine similarities.
+    Each step takes the candidate with the best
+    ``weight * relevance - (1 - weight) * max similarity to the picks so
+    far``, so a near-copy of a picked chunk loses to a slightly less
+    relevant chunk that adds something new. At most ``max_per_group``
+    candidates of each group are picked while other groups still have
+    candidates.
+    """
+    weight = settings.RETRIEVAL_MMR_WEIGHT if weight is None else weight
+    relevance = np.asarray(relevance, dtype=np.float32)
+    similarities = np.asarray(similarities, dtype=np.float32)
+    count = len(relevance)
+    k = min(k, count)
+    if k <= 0:
+        return []
+
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    if groups is not None:
+        _, groups = np.unique(np.asarray(groups, dtype=object), return_inverse=True)
+        picked_per_group = np.zeros(groups.max() + 1, dtype=np.int32)
+
+    picks = []
+    for _ in range(k):
+        eligible = available
+        if groups is not None and max_per_group:
+            capped = available & (picked_per_group[groups] < max_per_group)
+            # Lift the cap rather than return fewer than k chunks.
+            if capped.any():
+                eligible = capped
+        scores = weight * relevance - (1 - weight) * redundancy
+        pick = int(np.argmax(np.where(eligible, scores, -np.inf)))
+        picks.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, similarities[pick])
+        if groups is not None:
+            picked_per_group[groups[pick]] += 1
+    return picks
+
+
+def rerank_chunks(chunks, k):
+    """
+    Re-rank retrieved ``chunks`` (best first, with ``similarities`` loaded)
+    and keep ``k``, capping chunks per document at
+    RETRIEVAL_MAX_CHUNKS_PER_DOCUMENT.
+
+    Relevance is the cosine similarity to the query, or the fused hybrid
+    score scaled to the top score, so keyword hits aren't judged by their
+    embedding alone.
+    """
+    if len(chunks) <= 1:
+        return chunks[:k]
+    if all(getattr(chunk, "score", None) is not None for chunk in chunks):
+        scores = np.array([float(chunk.score) for chunk in chunks])
+        relevance = scores / scores.max()
+    else:
+        relevance = [1 - chunk.distance for chunk in chunks]
+    picks = mmr_select(
+        relevance,
+        np.vstack([chunk.similarities for chunk in chunks]),
+        k,
+        groups=[chunk.document_id for chunk in chunks],
+        max_per_group=settings.RETRIEVAL_MAX_CHUNKS_PER_DOCUMENT,
+    )
+    return [chunks[pick] for pick in picks]
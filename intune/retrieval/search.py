@@ -0,0 +1,358 @@
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from intune.models import Document, DocumentChunk
+from intune.retrieval.records import ChunkRecord, DocumentRecord
+from intune.retrieval.rerank import rerank_chunks
+from intune.retrieval.vector_index import (
+    copy_rows,
+    get_team_index,
+    resync_team_index,
+)
+from intune.timing import StageTimer
+
+# Retrieval reads only what prompts and re-ranking use: no timestamps,
+# chunk metadata, search vectors or embeddings. Rows are copied out in
+# binary, see ``copy_rows``.
+CHUNK_COLUMNS = "chunk.id, chunk.document_id, chunk.chunk_index, chunk.text"
+CHUNK_TYPES = ["uuid", "uuid", "int4", "text"]
+
+# The nearest chunks are found first and their columns read afterwards, so
+# an exact search doesn't carry the text and embedding of every row of the
+# team through the sort.
+VECTOR_SEARCH_SQL = f"""
+SELECT {CHUNK_COLUMNS}, nearest.distance
+FROM (
+    SELECT id, embedding <=> %(embedding)s::vector AS distance
+    FROM document_chunks
+    WHERE team_id = %(team_id)s AND document_id = ANY(%(document_ids)s)
+    ORDER BY distance
+    LIMIT %(limit)s
+) nearest
+JOIN document_chunks AS chunk
+    ON chunk.id = nearest.id AND chunk.team_id = %(team_id)s
+ORDER BY nearest.distance
+"""
+
+KEYWORD_HITS_SQL = """
+keyword_hits AS (
+    SELECT id, row_number() OVER (ORDER BY score DESC) AS rank
+    FROM (
+        SELECT id, ts_rank_cd(search_vector, query) AS score
+        FROM document_chunks,
+            websearch_to_tsquery('english', %(query_text)s) AS query
+        WHERE team_id = %(team_id)s AND document_id = ANY(%(document_ids)s)
+            AND search_vector @@ query
+        ORDER BY score DESC
+        LIMIT %(candidates)s
+    ) matches
+)"""
+
+# Keyword and vector search in one round trip, merged with reciprocal rank
+# fusion: each list contributes 1 / (rrf_k + rank) for every chunk it
+# ranks, so chunks found by both come first and either list alone can still
+# surface exact identifiers (error codes, SKUs, policy numbers) that
+# embeddings miss. Ranks, not raw scores, are fused because cosine distance
+# and ts_rank_cd aren't on comparable scales.
+HYBRID_SEARCH_SQL = f"""
+WITH vector_hits AS (
+    SELECT id, row_number() OVER (ORDER BY distance) AS rank
+    FROM (
+        SELECT id, embedding <=> %(embedding)s::vector AS distance
+        FROM document_chunks
+        WHERE team_id = %(team_id)s AND document_id = ANY(%(document_ids)s)
+        ORDER BY distance
+        LIMIT %(candidates)s
+    ) nearest
+),
+{KEYWORD_HITS_SQL},
+fused AS (
+    SELECT id,
+        COALESCE(1.0 / (%(rrf_k)s + vector_hits.rank), 0)
+            + COALESCE(1.0 / (%(rrf_k)s + keyword_hits.rank), 0) AS score
+    FROM vector_hits FULL OUTER JOIN keyword_hits USING (id)
+)
+SELECT {CHUNK_COLUMNS},
+    chunk.embedding <=> %(embedding)s::vector AS distance,
+    fused.score::float8 AS score
+FROM fused
+JOIN document_chunks AS chunk
+    ON chunk.id = fused.id AND chunk.team_id = %(team_id)s
+ORDER BY fused.score DESC, distance
+LIMIT %(limit)s
+"""
+
+# The keyword half of HYBRID_SEARCH_SQL for vector hits found in memory:
+# returns the given vector hits plus the keyword hits, with their keyword
+# rank, for the fusion to be done in Python.
+KEYWORD_SEARCH_SQL = f"""
+WITH {KEYWORD_HITS_SQL},
+wanted AS (
+    SELECT unnest(%(vector_ids)s::uuid[]) AS id
+    UNION
+    SELECT id FROM keyword_hits
+)
+SELECT {CHUNK_COLUMNS}, keyword_hits.rank AS keyword_rank
+FROM wanted
+JOIN document_chunks AS chunk
+    ON chunk.id = wanted.id AND chunk.team_id = %(team_id)s
+LEFT JOIN keyword_hits ON keyword_hits.id = wanted.id
+"""
+
+# Wraps a search for re-ranking: the embeddings of the hits stay in
+# Postgres, and each hit comes back with its cosine similarity to every hit,
+# in hit order, 4 bytes per pair instead of 6 KB per embedding. Texts are
+# left out too; only the picked chunks' are read, see ``add_texts``.
+SIMILARITIES_SQL = """
+WITH hits AS MATERIALIZED (
+    SELECT search.*, chunk.embedding,
+        row_number() OVER (ORDER BY {order}) AS position
+    FROM ({search}) search
+    JOIN document_chunks AS chunk
+        ON chunk.id = search.id AND chunk.team_id = %(team_id)s
+)
+SELECT {columns},
+    ARRAY(
+        SELECT (1 - (hits.embedding <=> other.embedding))::float4
+        FROM hits AS other
+        ORDER BY other.position
+    ) AS similarities
+FROM hits
+ORDER BY position
+"""
+
+CHUNKS_BY_ID_SQL = f"""
+SELECT {CHUNK_COLUMNS}
+FROM document_chunks AS chunk
+WHERE chunk.team_id = %(team_id)s AND chunk.id = ANY(%(ids)s)
+"""
+
+
+def plan_search(team_chunks, limit, ef_search=None):
+    """
+    Decide how to search a team with ``team_chunks`` chunks.
+
+    Returns the ``hnsw.ef_search`` to use, or None for an exact search.
+    Every team has its own partition and HNSW graph, so the index only
+    returns the team's chunks. Teams small enough for an exact scan of
+    their partition to be cheap get complete results instead.
+    """
+    if team_chunks <= settings.VECTOR_SEARCH_EXACT_MAX_CHUNKS:
+        return None
+    return max(ef_search or settings.VECTOR_SEARCH_EF_SEARCH, limit)
+
+
+def search_chunks(
+    team, query_embedding, limit=4, ef_search=None, query_text=None, timer=None
+):
+    """
+    Return the ``limit`` chunks of ``team``'s searchable documents most
+    relevant to the query as ``ChunkRecord``s, best first, with their
+    ``distance`` and their ``DocumentRecord``.
+
+    Without ``query_text`` (or with HYBRID_SEARCH_ENABLED off) this is a
+    pure vector search on ``query_embedding``. With it, keyword and vector
+    search are fused, see ``HYBRID_SEARCH_SQL``. With RETRIEVAL_MMR_ENABLED,
+    RETRIEVAL_CANDIDATES chunks are retrieved and re-ranked for diversity,
+    see ``rerank_chunks``; only their pairwise similarities are fetched for
+    that, and only the texts of the chunks kept. Time is charged to the "search" and "rerank"
+    stages of ``timer``.
+
+    Filtering on team_id, the partition key, confines the search to the
+    team's partition. With IN_MEMORY_VECTOR_INDEX_ENABLED, small enough
+    teams are searched in this process's index instead. The team's
+    documents are loaded separately and attached.
+    """
+    timer = timer or StageTimer()
+    rerank = settings.RETRIEVAL_MMR_ENABLED
+    candidates = max(settings.RETRIEVAL_CANDIDATES, limit) if rerank else limit
+
+    with timer.stage("search"):
+        rows = Document.objects.filter(team=team, is_searchable=True).values_list(
+            "chunk_count", *DocumentRecord.__slots__
+        )
+        if not rows:
+            return []
+        team_chunks = sum(row[0] for row in rows)
+        documents = {row[1]: DocumentRecord(*row[1:]) for row in rows}
+        hybrid = bool(query_text) and settings.HYBRID_SEARCH_ENABLED
+
+        if (
+            settings.IN_MEMORY_VECTOR_INDEX_ENABLED
+            and team_chunks <= settings.IN_MEMORY_VECTOR_INDEX_MAX_CHUNKS
+        ):
+            chunks = search_in_memory(
+                team,
+                list(documents),
+                query_embedding,
+                candidates,
+                query_text if hybrid else None,
+                with_similarities=rerank,
+            )
+        else:
+            chunks = search_in_postgres(
+                team,
+                list(documents),
+                query_embedding,
+                candidates,
+                plan_search(team_chunks, candidates, ef_search),
+                query_text if hybrid else None,
+                with_similarities=rerank,
+            )
+
+    if rerank:
+        with timer.stage("rerank"):
+            chunks = rerank_chunks(chunks, limit)
+        with timer.stage("search"):
+            chunks = add_texts(team, chunks)
+
+    for chunk in chunks:
+        chunk.document = documents[chunk.document_id]
+    return chunks
+
+
+def search_in_postgres(
+    team,
+    document_ids,
+    query_embedding,
+    limit,
+    ef_search,
+    query_text=None,
+    with_similarities=False,
+):
+    embedding_field = DocumentChunk._meta.get_field("embedding")
+    params = {
+        "embedding": embedding_field.get_prep_value(query_embedding),
+        "team_id": team.id,
+        "document_ids": document_ids,
+        "limit": limit,
+    }
+    if query_text:
+        sql, order = HYBRID_SEARCH_SQL, "score DESC, distance"
+        columns = ["distance", "score"]
+        params.update(
+            query_text=query_text,
+            candidates=max(settings.HYBRID_SEARCH_CANDIDATES, limit),
+            rrf_k=settings.HYBRID_SEARCH_RRF_K,
+        )
+    else:
+        sql, order, columns = VECTOR_SEARCH_SQL, "distance", ["distance"]
+    types = CHUNK_TYPES + ["float8"] * len(columns)
+    if with_similarities:
+        columns = ["id", "document_id", "chunk_index", "NULL::text"] + columns
+        sql = SIMILARITIES_SQL.format(
+            search=sql, order=order, columns=", ".join(columns)
+        )
+        types.append("float4[]")
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # set_config(..., true) is SET LOCAL, which only lasts until the end
+        # of the transaction, but takes the value as a query parameter.
+        if ef_search is None:
+            # HNSW can only be read through an index scan; bitmap scans of
+            # the team index remain available.
+            cursor.execute("SELECT set_config('enable_indexscan', 'off', true)")
+        else:
+            cursor.execute(
+                "SELECT set_config('hnsw.ef_search', %s, true)", [str(ef_search)]
+            )
+        rows = copy_rows(sql, params, types)
+    if not with_similarities:
+        return [ChunkRecord(*row) for row in rows]
+    return [ChunkRecord(*row[:-1], similarities=row[-1]) for row in rows]
+
+
+def search_in_memory(
+    team,
+    document_ids,
+    query_embedding,
+    limit,
+    query_text=None,
+    with_similarities=False,
+):
+    """
+    Like ``search_in_postgres``, but the vector search is an exact search
+    of the team's in-memory index. Postgres only returns the rows of the
+    hits, plus the keyword hits for a hybrid search; their similarities are
+    computed from the index.
+    """
+    index = get_team_index(team)
+    if not query_text:
+        distances = dict(index.search(query_embedding, limit, document_ids))
+        rows = copy_rows(
+            CHUNKS_BY_ID_SQL, {"team_id": team.id, "ids": list(distances)}, CHUNK_TYPES
+        )
+        chunks = [ChunkRecord(*row, distance=distances[row[0]]) for row in rows]
+        chunks.sort(key=lambda chunk: chunk.distance)
+        if with_similarities:
+            add_similarities(chunks, index)
+        return chunks
+
+    candidates = max(settings.HYBRID_SEARCH_CANDIDATES, limit)
+    nearest = index.search(query_embedding, candidates, document_ids)
+    vector_ranks = {chunk_id: rank for rank, (chunk_id, _) in enumerate(nearest, 1)}
+    rows = copy_rows(
+        KEYWORD_SEARCH_SQL,
+        {
+            "vector_ids": list(vector_ranks),
+            "query_text": query_text,
+            "team_id": team.id,
+            "document_ids": document_ids,
+            "candidates": candidates,
+        },
+        CHUNK_TYPES + ["int8"],
+    )
+    if any(row[0] not in index.positions for row in rows):
+        # A keyword hit on a chunk written since the index was synced.
+        index = resync_team_index(team)
+        rows = [row for row in rows if row[0] in index.positions]
+    distances = dict(nearest)
+    distances.update(
+        index.distances(
+            query_embedding, [row[0] for row in rows if row[0] not in distances]
+        )
+    )
+
+    rrf_k = settings.HYBRID_SEARCH_RRF_K
+    chunks = []
+    for *columns, keyword_rank in rows:
+        chunk = ChunkRecord(*columns, distance=distances[columns[0]])
+        chunk.score = 0.0
+        if chunk.id in vector_ranks:
+            chunk.score += 1.0 / (rrf_k + vector_ranks[chunk.id])
+        if keyword_rank is not None:
+            chunk.score += 1.0 / (rrf_k + keyword_rank)
+        chunks.append(chunk)
+    chunks.sort(key=lambda chunk: (-chunk.score, chunk.distance))
+    chunks = chunks[:limit]
+    if with_similarities:
+        add_similarities(chunks, index)
+    return chunks
+
+
+def add_texts(team, chunks):
+    """
+    Read the texts of ``chunks`` that were retrieved without them. Chunks
+    deleted in the meantime are dropped.
+    """
+    missing = [chunk.id for chunk in chunks if chunk.text is None]
+    if not missing:
+        return chunks
+    rows = copy_rows(
+        CHUNKS_BY_ID_SQL, {"team_id": team.id, "ids": missing}, CHUNK_TYPES
+    )
+    texts = {row[0]: row[3] for row in rows}
+    for chunk in chunks:
+        if chunk.text is None:
+            chunk.text = texts.get(chunk.id)
+    return [chunk for chunk in chunks if chunk.text is not None]
+
+
+def add_similarities(chunks, index):
+    """Set the ``similarities`` of ``chunks`` to each other from ``index``."""
+    if not chunks:
+        return
+    vectors = np.vstack([index.vector(chunk.id) for chunk in chunks])
+    for chunk, similarities in zip(chunks, vectors @ vectors.T):
+        chunk.similarities = similarities
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 import os
 from pathlib import Path
 from dotenv import load_dotenv
+from kombu import Queue
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "intune",
 ]
 
@@ -137,10 +139,215 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Diagnostics of the intune package go to the console at INTUNE_LOG_LEVEL;
+# DEBUG adds the prompt token counts of every answer.
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "intune": {
+            "handlers": ["console"],
+            "level": os.getenv("INTUNE_LOG_LEVEL", "INFO"),
+            "propagate": False,
+        },
+    },
+}
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
 # Celery Configuration Options
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
 
+# Work is split across queues so bulk ingestion can't delay latency-sensitive
+# tasks: "interactive" for user-facing work, "ingestion" for documents and
+# their first chunks, "bulk" for the chunks of large documents beyond
+# INGESTION_BULK_AFTER_CHUNKS, and "maintenance" for housekeeping. A worker
+# started without -Q consumes all of them.
+CELERY_TASK_QUEUES = [
+    Queue(name, routing_key=name)
+    for name in ("interactive", "ingestion", "bulk", "maintenance")
+]
+CELERY_TASK_DEFAULT_QUEUE = "interactive"
+CELERY_TASK_ROUTES = {
+    "intune.tasks.process_document": {"queue": "ingestion"},
+    "intune.tasks.reingest_document": {"queue": "ingestion"},
+    "intune.tasks.process_document_chunk": {"queue": "ingestion"},
+    "intune.tasks.process_document_batch": {"queue": "ingestion"},
+    # Polls every INGESTION_POLL_INTERVAL seconds per document being ingested.
+    "intune.tasks.finalize_document_ingestion": {"queue": "maintenance"},
+    "intune.tasks.answer_question": {"queue": "interactive"},
+    "intune.tasks.generate_chat_title": {"queue": "interactive"},
+    "intune.tasks.summarize_chat": {"queue": "interactive"},
+    "intune.celery.debug_task": {"queue": "maintenance"},
+}
+# Concurrency and prefetch multiplier of the worker for each queue, used by
+# `python manage.py run_worker <queue>`. Long-running embedding tasks use a
+# prefetch of 1 so an idle worker isn't left waiting behind a busy one.
+CELERY_WORKER_PROFILES = {
+    "interactive": {
+        "concurrency": int(os.getenv("CELERY_INTERACTIVE_CONCURRENCY", "4")),
+        "prefetch_multiplier": int(os.getenv("CELERY_INTERACTIVE_PREFETCH", "4")),
+    },
+    "ingestion": {
+        "concurrency": int(os.getenv("CELERY_INGESTION_CONCURRENCY", "4")),
+        "prefetch_multiplier": int(os.getenv("CELERY_INGESTION_PREFETCH", "1")),
+    },
+    "bulk": {
+        "concurrency": int(os.getenv("CELERY_BULK_CONCURRENCY", "4")),
+        "prefetch_multiplier": int(os.getenv("CELERY_BULK_PREFETCH", "1")),
+    },
+    "maintenance": {
+        "concurrency": int(os.getenv("CELERY_MAINTENANCE_CONCURRENCY", "1")),
+        "prefetch_multiplier": int(os.getenv("CELERY_MAINTENANCE_PREFETCH", "1")),
+    },
+}
+
 AUTH_USER_MODEL = "intune.User"
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+
+# Vector search
+# Build parameters of the HNSW indexes in benchmarks.vector_search_latency:
+# graph degree and candidate list size while building. The index on
+# document_chunks.embedding is built with the defaults (migration 0019).
+VECTOR_INDEX_M = int(os.getenv("VECTOR_INDEX_M", "16"))
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", "64"))
+# Candidate list size per search (hnsw.ef_search). Higher is slower but
+# finds more of the true nearest neighbours.
+VECTOR_SEARCH_EF_SEARCH = int(os.getenv("VECTOR_SEARCH_EF_SEARCH", "100"))
+# Hybrid retrieval fuses the top HYBRID_SEARCH_CANDIDATES keyword and vector
+# hits with reciprocal rank fusion; HYBRID_SEARCH_RRF_K damps the weight of
+# the top ranks.
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+HYBRID_SEARCH_CANDIDATES = int(os.getenv("HYBRID_SEARCH_CANDIDATES", "20"))
+HYBRID_SEARCH_RRF_K = int(os.getenv("HYBRID_SEARCH_RRF_K", "60"))
+# Answers to a team's first questions are reused for later questions whose
+# embedding is at least ANSWER_CACHE_SIMILARITY (cosine) similar, until the
+# team's documents change or ANSWER_CACHE_TTL seconds have passed.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.97"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "604800"))
+# Teams with at most this many chunks are searched exactly instead of
+# through their partition's HNSW index: scanning a small partition is cheap,
+# and unlike the approximate index it never misses a nearer chunk.
+VECTOR_SEARCH_EXACT_MAX_CHUNKS = int(
+    os.getenv("VECTOR_SEARCH_EXACT_MAX_CHUNKS", "5000")
+)
+# Retrieve RETRIEVAL_CANDIDATES chunks and keep the prompt's few by maximal
+# marginal relevance: RETRIEVAL_MMR_WEIGHT trades relevance (1.0) against
+# novelty (0.0), and at most RETRIEVAL_MAX_CHUNKS_PER_DOCUMENT chunks are
+# taken from one document while others qualify (0 for no cap).
+RETRIEVAL_MMR_ENABLED = os.getenv("RETRIEVAL_MMR_ENABLED", "true").lower() == "true"
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+RETRIEVAL_MMR_WEIGHT = float(os.getenv("RETRIEVAL_MMR_WEIGHT", "0.7"))
+RETRIEVAL_MAX_CHUNKS_PER_DOCUMENT = int(
+    os.getenv("RETRIEVAL_MAX_CHUNKS_PER_DOCUMENT", "2")
+)
+# Optionally search teams with at most IN_MEMORY_VECTOR_INDEX_MAX_CHUNKS
+# chunks in an index held by each web or worker process instead of in
+# Postgres. Least recently used teams are evicted to keep the indexes of a
+# process under IN_MEMORY_VECTOR_INDEX_MAX_MB (about 6 MB per 1000 chunks).
+IN_MEMORY_VECTOR_INDEX_ENABLED = (
+    os.getenv("IN_MEMORY_VECTOR_INDEX_ENABLED", "false").lower() == "true"
+)
+IN_MEMORY_VECTOR_INDEX_MAX_CHUNKS = int(
+    os.getenv("IN_MEMORY_VECTOR_INDEX_MAX_CHUNKS", "50000")
+)
+IN_MEMORY_VECTOR_INDEX_MAX_MB = int(os.getenv("IN_MEMORY_VECTOR_INDEX_MAX_MB", "1024"))
+
+# Answer prompts
+# Up to PROMPT_MAX_SNIPPETS retrieved chunks within PROMPT_MAX_DISTANCE of
+# the question are packed, best first, into PROMPT_SNIPPET_TOKENS. Follow-up
+# questions carry the chat's rolling summary, at most CHAT_SUMMARY_TOKENS,
+# and the newest of the last PROMPT_HISTORY_MESSAGES messages it doesn't
+# cover that fit in PROMPT_HISTORY_TOKENS. Older messages are folded into
+# the summary after every answer.
+PROMPT_MAX_SNIPPETS = int(os.getenv("PROMPT_MAX_SNIPPETS", "6"))
+PROMPT_MAX_DISTANCE = float(os.getenv("PROMPT_MAX_DISTANCE", "0.5"))
+PROMPT_SNIPPET_TOKENS = int(os.getenv("PROMPT_SNIPPET_TOKENS", "2000"))
+PROMPT_HISTORY_MESSAGES = int(os.getenv("PROMPT_HISTORY_MESSAGES", "4"))
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "800"))
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+# Answers are generated by the answer_question task, which publishes them
+# piece by piece to a Redis stream kept for ANSWER_STREAM_TTL seconds. The
+# chat page's event stream gives up after ANSWER_STREAM_IDLE_TIMEOUT seconds
+# without news from the task.
+ANSWER_STREAM_TTL = int(os.getenv("ANSWER_STREAM_TTL", "600"))
+ANSWER_STREAM_IDLE_TIMEOUT = int(os.getenv("ANSWER_STREAM_IDLE_TIMEOUT", "120"))
+
+# OpenAI rate limiting and retries
+# Per-model limits enforced by a token bucket in Redis, shared by every web
+# and Celery process. Keep them at or below the account's limits.
+OPENAI_RATE_LIMIT_ENABLED = (
+    os.getenv("OPENAI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+)
+OPENAI_RATE_LIMITS = {
+    "text-embedding-ada-002": {
+        "requests_per_minute": int(os.getenv("OPENAI_EMBEDDING_RPM", "3000")),
+        "tokens_per_minute": int(os.getenv("OPENAI_EMBEDDING_TPM", "1000000")),
+    },
+    "gpt-5-nano": {
+        "requests_per_minute": int(os.getenv("OPENAI_CHAT_RPM", "500")),
+        "tokens_per_minute": int(os.getenv("OPENAI_CHAT_TPM", "200000")),
+    },
+}
+# Longest a request waits for the limiter before failing with OpenAIError.
+OPENAI_RATE_LIMIT_MAX_WAIT = float(os.getenv("OPENAI_RATE_LIMIT_MAX_WAIT", "30"))
+# Retries for 429, 5xx and network errors, with jittered exponential backoff.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "20"))
+# The circuit opens after OPENAI_CIRCUIT_THRESHOLD failures within
+# OPENAI_CIRCUIT_WINDOW seconds and rejects requests for OPENAI_CIRCUIT_COOLDOWN.
+OPENAI_CIRCUIT_THRESHOLD = int(os.getenv("OPENAI_CIRCUIT_THRESHOLD", "10"))
+OPENAI_CIRCUIT_WINDOW = int(os.getenv("OPENAI_CIRCUIT_WINDOW", "60"))
+OPENAI_CIRCUIT_COOLDOWN = int(os.getenv("OPENAI_CIRCUIT_COOLDOWN", "30"))
+# Connection pools of each process's OpenAI clients. With HTTP/2, concurrent
+# requests share connections instead of opening one each.
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "true").lower() == "true"
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+
+# Ingestion
+EMBEDDING_MODEL = "text-embedding-ada-002"
+# PDFs longer than one range are extracted in parallel by this many processes.
+PDF_EXTRACTION_WORKERS = int(os.getenv("PDF_EXTRACTION_WORKERS", "4"))
+PDF_EXTRACTION_PAGES_PER_RANGE = int(os.getenv("PDF_EXTRACTION_PAGES_PER_RANGE", "50"))
+# Text and markdown files are read in sections of roughly this many characters.
+TEXT_SECTION_MAX_CHARS = int(os.getenv("TEXT_SECTION_MAX_CHARS", "20000"))
+# How extracted text is split into chunks: "sliding_window", "page" or a dotted path.
+INGESTION_CHUNKER = os.getenv("INGESTION_CHUNKER", "sliding_window")
+CHUNK_TARGET_TOKENS = int(os.getenv("CHUNK_TARGET_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+# Group chunks into multi-input embedding requests instead of one request per chunk.
+INGESTION_BATCHED = os.getenv("INGESTION_BATCHED", "true").lower() == "true"
+# Upper bounds for a single embeddings request: number of inputs and estimated tokens.
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+# Chunks of a document past this index are embedded on the "bulk" queue.
+INGESTION_BULK_AFTER_CHUNKS = int(os.getenv("INGESTION_BULK_AFTER_CHUNKS", "500"))
+# Celery-level retries of chunk tasks whose embedding request ultimately failed.
+EMBEDDING_TASK_MAX_RETRIES = int(os.getenv("EMBEDDING_TASK_MAX_RETRIES", "5"))
+# How chunk rows are written: "copy" (binary COPY FROM STDIN) or "bulk_create".
+INGESTION_WRITE_METHOD = os.getenv("INGESTION_WRITE_METHOD", "copy")
+INGESTION_WRITE_BATCH_SIZE = int(os.getenv("INGESTION_WRITE_BATCH_SIZE", "1000"))
+# The ingestion finalizer polls chunk tasks every INGESTION_POLL_INTERVAL
+# seconds and gives up (marking the document failed) after INGESTION_TIMEOUT.
+INGESTION_POLL_INTERVAL = int(os.getenv("INGESTION_POLL_INTERVAL", "2"))
+INGESTION_TIMEOUT = int(os.getenv("INGESTION_TIMEOUT", "3600"))
+# Embeddings are cached by model + text hash in Postgres, with optional
+# in-process and Redis layers in front of it.
+EMBEDDING_CACHE_LOCAL_SIZE = int(os.getenv("EMBEDDING_CACHE_LOCAL_SIZE", "2048"))
+EMBEDDING_CACHE_REDIS = os.getenv("EMBEDDING_CACHE_REDIS", "false").lower() == "true"
+EMBEDDING_CACHE_REDIS_TTL = int(os.getenv("EMBEDDING_CACHE_REDIS_TTL", "604800"))
+# Question embeddings are cached in-process and in Redis, keyed by model
+# and normalized question, so repeated questions skip the API call.
+QUERY_EMBEDDING_CACHE_LOCAL_SIZE = int(
+    os.getenv("QUERY_EMBEDDING_CACHE_LOCAL_SIZE", "1024")
+)
+QUERY_EMBEDDING_CACHE_TTL = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from intune.models import Document, Team
+from intune.partitions import create_chunk_partition, drop_chunk_partition
+
+
+@receiver(post_save, sender=Team)
+def create_team_chunk_partition(sender, instance, created, **kwargs):
+    if created:
+        create_chunk_partition(instance.id)
+
+
+@receiver(pre_delete, sender=Team)
+def drop_team_chunk_partition(sender, instance, **kwargs):
+    # Runs before the cascade, which then finds no chunks left to delete.
+    drop_chunk_partition(instance.id)
+
+
+@receiver(post_delete, sender=Document)
+def invalidate_team_answers(sender, instance, **kwargs):
+    if instance.is_searchable:
+        Team.documents_changed(instance.team_id)
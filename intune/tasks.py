@@ -1,17 +1,41 @@
 import time
-from celery import shared_task
-from intune.models import Document, DocumentChunk
-import httpx
+import uuid
+from celery import current_app, shared_task
+from celery.result import GroupResult
+from django.db import transaction
+from django.db.models import F
+from intune.models import Chat, ChatConversation, Document, DocumentChunk
 from django.conf import settings
-import pymupdf
-from django.contrib import messages
+from django.utils import timezone
 
+from intune.answering import publish_answer
+from intune.ingestion.chunking import Chunk, get_chunker
+from intune.ingestion.embedding import embed_chunks, iter_embedding_batches
+from intune.ingestion.embedding_cache import (
+    cache_embeddings,
+    embedding_cache_key,
+    get_cached_embeddings,
+)
+from intune.ingestion.extraction import iter_document_segments
+from intune.ingestion.persistence import DocumentChunkWriter
+from intune.openai_client import OpenAIError
+from intune.retrieval.context import history_batches, pack_history
+from intune.timing import StageTimer
+from intune.tokens import truncate_to_tokens
+from intune.utils import get_chat_title_from_llm, get_updated_chat_summary
 
-def simple_chunk(text, num_chunks=5):
-    """Split text into roughly equal chunks (by length)."""
-    length = len(text)
-    chunk_size = max(1, length // num_chunks)
-    return [text[i : i + chunk_size].strip() for i in range(0, length, chunk_size)]
+
+def chunk_task_queue(chunk_index):
+    """
+    Queue for the task embedding the chunk at ``chunk_index``.
+
+    The first chunks of every document go to the ingestion queue and only
+    the tail of a large document overflows to the bulk queue, so a small
+    upload never waits behind thousands of pages from another one.
+    """
+    if chunk_index < settings.INGESTION_BULK_AFTER_CHUNKS:
+        return "ingestion"
+    return "bulk"
 
 
 @shared_task
@@ -23,68 +47,328 @@ def process_document(document_id):
 
     print(f"Processing document: {document.name} (ID: {document.id})")
 
-    content_type = document.content_type
-    file_path = document.file.path
+    segments, location_key = iter_document_segments(document)
+    if segments is None:
+        print(f"Unsupported content type: {document.content_type}")
+        document.mark_failed(f"Unsupported content type: {document.content_type}")
+        return
 
-    # PDF
-    if content_type == "application/pdf":
-        doc = pymupdf.open(file_path)
-        for page_number, page in enumerate(doc, start=1):
-            text = page.get_text("text").strip()
-            if not text:
-                continue
+    document.mark_processing()
+    timer = StageTimer()
+    try:
+        segments = timer.iterate("extract", segments)
+        chunks = get_chunker().chunk(segments, location_key=location_key)
 
-            # # Remove excessive whitespace/newlines
-            # text = " ".join(text.split())
+        # Tasks are queued as chunks stream out of the extractor, so the
+        # embedding stage starts before extraction has finished.
+        results = []
+        if settings.INGESTION_BATCHED:
+            for batch in timer.iterate("chunk", iter_embedding_batches(chunks)):
+                result = process_document_batch.apply_async(
+                    (document.id, batch), queue=chunk_task_queue(batch[0].index)
+                )
+                results.append(result)
+        else:
+            for chunk in timer.iterate("chunk", chunks):
+                result = process_document_chunk.apply_async(
+                    (document.id, chunk.index, chunk.text, chunk.metadata),
+                    queue=chunk_task_queue(chunk.index),
+                )
+                results.append(result)
+    except Exception as exc:
+        document.mark_failed(str(exc), timer.timings)
+        raise
 
-            # # Split each page into ~5 chunks
-            # chunks = simple_chunk(text, num_chunks=3)
+    # A chord needs its whole header up front, which would block on
+    # extraction. Track the tasks as a group and let the finalizer wait on
+    # it instead, like Celery's own chord_unlock.
+    group_result = GroupResult(str(uuid.uuid4()), results, app=current_app)
+    group_result.save()
+    finalize_document_ingestion.delay(document.id, group_result.id, timer.timings)
 
-            # # Send each chunk to Celery for async processing
-            # for idx, chunk in enumerate(chunks, start=1):
-            #     process_document_chunk.delay(document.id, idx, chunk)
-            process_document_chunk.delay(document.id, page_number, text.strip())
-        doc.close()
 
-    # TXT or MD
-    elif content_type in ["text/plain", "text/markdown", "text/md"]:
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            for line_number, line in enumerate(lines, start=1):
-                print(f"--- Line {line_number} ---\n{line.strip()}\n")
+@shared_task(bind=True, max_retries=None)
+def finalize_document_ingestion(self, document_id, group_id, stage_timings):
+    """
+    Completion callback for the chunk tasks of a document: records status,
+    chunk count and per-stage timings, and makes the document searchable.
+    """
+    document = Document.objects.filter(id=document_id).first()
+    if not document:
+        return
+
+    group_result = GroupResult.restore(group_id)
+    if not group_result.ready():
+        running_for = timezone.now() - document.processing_started_at
+        if running_for.total_seconds() < settings.INGESTION_TIMEOUT:
+            raise self.retry(countdown=settings.INGESTION_POLL_INTERVAL)
+        document.mark_failed("Timed out waiting for chunks to be embedded.")
+        return
 
+    results = [result.result for result in group_result.results if result.successful()]
+    failed_tasks = len(group_result.results) - len(results)
+    chunk_count = sum(result["chunks"] for result in results)
+    for stage in ("embed", "persist"):
+        stage_timings[stage] = sum(
+            result["timings"].get(stage, 0) for result in results
+        )
+    stage_timings["total"] = (
+        timezone.now() - document.processing_started_at
+    ).total_seconds()
+    group_result.forget()
+
+    if failed_tasks:
+        document.chunk_count = chunk_count
+        document.mark_failed(
+            f"{failed_tasks} of {len(group_result.results)} chunk tasks failed.",
+            stage_timings,
+        )
     else:
-        print(f"Unsupported content type: {content_type}")
+        document.mark_completed(chunk_count, stage_timings)
+    print(
+        f"Finished document {document.id}: {document.status}, {chunk_count} chunks, {stage_timings}"
+    )
 
 
-@shared_task
-def process_document_chunk(document_id, chunk_index, text):
+def embed_document_chunks(document_id, chunks):
+    """
+    Embed ``chunks``, reusing cached embeddings for text seen before.
+
+    Returns ``{chunk_index: embedding}`` and raises ``OpenAIError`` if the
+    API call failed. Cache hits and misses are added to the document's
+    counters.
+    """
+    embeddings = get_cached_embeddings(chunks)
+    misses = [chunk for chunk in chunks if chunk[0] not in embeddings]
+    if misses:
+        fresh = embed_chunks(misses)
+        cache_embeddings(misses, fresh)
+        embeddings.update(fresh)
+
+    hits = len(chunks) - len(misses)
+    print(
+        f"Embedding cache for document {document_id}: {hits} hits, {len(misses)} misses."
+    )
+    Document.objects.filter(id=document_id).update(
+        embedding_cache_hits=F("embedding_cache_hits") + hits,
+        embedding_cache_misses=F("embedding_cache_misses") + len(misses),
+    )
+    return embeddings
+
+
+# Embedding failures that survived the in-request retries (long outages,
+# open circuit, rate limiter timeouts) are retried later by Celery, which
+# frees the worker in the meantime.
+EMBEDDING_TASK_RETRY = {
+    "autoretry_for": (OpenAIError,),
+    "retry_backoff": True,
+    "retry_backoff_max": 600,
+    "retry_jitter": True,
+    "max_retries": settings.EMBEDDING_TASK_MAX_RETRIES,
+}
+
+
+@shared_task(**EMBEDDING_TASK_RETRY)
+def process_document_chunk(document_id, chunk_index, text, metadata=None):
     print(f"Processing chunk {chunk_index} of document {document_id}...")
-    open_ai_api_key = settings.OPENAI_API_KEY
-    open_ai_url = "https://api.openai.com/v1/embeddings"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {open_ai_api_key}",
-    }
-    json_data = {
-        "input": text,
-        "model": "text-embedding-ada-002",
-        "encoding_format": "float",
-    }
-    response = httpx.post(open_ai_url, headers=headers, json=json_data)
-    if not response.status_code == 200:
-        print(
-            f"Failed to get embedding for chunk {chunk_index} of document {document_id}."
+    timer = StageTimer()
+    with timer.stage("embed"):
+        embeddings = embed_document_chunks(document_id, [(chunk_index, text)])
+
+    with timer.stage("persist"):
+        DocumentChunk.objects.create(
+            document_id=document_id,
+            team_id=Document.objects.values_list("team_id", flat=True).get(
+                id=document_id
+            ),
+            chunk_index=chunk_index,
+            text=text,
+            embedding=embeddings[chunk_index],
+            metadata=metadata,
+            content_hash=embedding_cache_key(text),
         )
+    return {"chunks": 1, "timings": timer.timings}
+
+
+@shared_task(**EMBEDDING_TASK_RETRY)
+def process_document_batch(document_id, chunks):
+    """Embed a batch of ``[chunk_index, text, metadata]`` chunks with one API request."""
+    chunks = [Chunk(*chunk) for chunk in chunks]
+    print(f"Processing batch of {len(chunks)} chunks of document {document_id}...")
+    timer = StageTimer()
+    with timer.stage("embed"):
+        embeddings = embed_document_chunks(document_id, chunks)
+
+    with timer.stage("persist"), DocumentChunkWriter(document_id) as writer:
+        for chunk in chunks:
+            writer.add(chunk.index, chunk.text, embeddings[chunk.index], chunk.metadata)
+    return {"chunks": len(chunks), "timings": timer.timings}
+
+
+@shared_task
+def reingest_document(document_id, old_file_name=None):
+    """
+    Bring the chunks of an updated document in line with its new file.
+
+    New chunks are diffed against the stored ones by content hash: only new
+    or changed chunks are embedded and inserted, chunks that are gone are
+    deleted and moved chunks get their index and metadata updated, all in
+    one transaction. The previous version's file, ``old_file_name``, is
+    deleted once its chunks have been replaced.
+    """
+    document = Document.objects.filter(id=document_id).first()
+    if not document:
+        print(f"Document with ID {document_id} not found.")
+        return
+
+    print(
+        f"Re-ingesting document: {document.name} v{document.version} (ID: {document.id})"
+    )
+
+    segments, location_key = iter_document_segments(document)
+    if segments is None:
+        print(f"Unsupported content type: {document.content_type}")
+        document.mark_failed(f"Unsupported content type: {document.content_type}")
         return
 
-    embedding = response.json()["data"][0]["embedding"]
+    document.mark_processing()
+    timer = StageTimer()
+    try:
+        segments = timer.iterate("extract", segments)
+        chunks = timer.iterate(
+            "chunk", get_chunker().chunk(segments, location_key=location_key)
+        )
+
+        # Filtering on the partition key confines every query to the team's partition.
+        team_chunks = DocumentChunk.objects.filter(team_id=document.team_id)
+
+        # content_hash -> stored rows with that text (identical chunks can repeat)
+        existing = {}
+        stored = team_chunks.filter(document=document).order_by("-chunk_index")
+        for row in stored.only("id", "chunk_index", "metadata", "content_hash"):
+            existing.setdefault(row.content_hash, []).append(row)
+
+        kept, moved, new_chunks = set(), [], []
+        for chunk in chunks:
+            rows = existing.get(embedding_cache_key(chunk.text))
+            if not rows:
+                new_chunks.append(chunk)
+                continue
+            # Prefer the row already at this index, else the lowest-indexed one.
+            row = next((r for r in rows if r.chunk_index == chunk.index), rows[-1])
+            rows.remove(row)
+            kept.add(row.id)
+            if row.chunk_index != chunk.index or row.metadata != chunk.metadata:
+                row.chunk_index, row.metadata = chunk.index, chunk.metadata
+                moved.append(row)
+
+        # Embed before opening the transaction so it never waits on the API.
+        embeddings = {}
+        for batch in iter_embedding_batches(new_chunks):
+            try:
+                with timer.stage("embed"):
+                    embeddings.update(embed_document_chunks(document.id, batch))
+            except OpenAIError as exc:
+                print(f"Failed to re-ingest document {document.id}: {exc}")
+                document.mark_failed(
+                    "Some chunks could not be embedded; the previous version is still searchable.",
+                    timer.timings,
+                )
+                return
+
+        removed = [row.id for rows in existing.values() for row in rows]
+        with timer.stage("persist"), transaction.atomic():
+            team_chunks.filter(id__in=removed).delete()
+            team_chunks.bulk_update(moved, ["chunk_index", "metadata"], batch_size=1000)
+            with DocumentChunkWriter(document.id, document.team_id) as writer:
+                for chunk in new_chunks:
+                    writer.add(
+                        chunk.index, chunk.text, embeddings[chunk.index], chunk.metadata
+                    )
+    except Exception as exc:
+        document.mark_failed(str(exc), timer.timings)
+        raise
+
+    timer.timings["total"] = (
+        timezone.now() - document.processing_started_at
+    ).total_seconds()
+    document.mark_completed(len(kept) + len(new_chunks), timer.timings)
+    if old_file_name and old_file_name != document.file.name:
+        document.file.storage.delete(old_file_name)
     print(
-        f"Embedding for chunk {chunk_index} of document {document_id} obtained and embedding are {embedding[:10]}..."
+        f"Re-ingested document {document.id}: {len(kept)} unchanged, "
+        f"{len(new_chunks)} new, {len(removed)} removed, {len(moved)} moved."
     )
-    DocumentChunk.objects.create(
-        document_id=document_id,
-        chunk_index=chunk_index,
-        text=text,
-        embedding=embedding,
+
+
+@shared_task
+def answer_question(chat_id, question_id):
+    """
+    Answer the question ``question_id`` of a chat, publishing the answer as
+    it is written for the chat page to stream, see ``publish_answer``.
+    """
+    chat = Chat.objects.select_related("team").filter(id=chat_id).first()
+    if not chat:
+        print(f"Chat with ID {chat_id} not found.")
+        return
+    question = ChatConversation.objects.filter(
+        id=question_id, chat=chat, sender="user"
+    ).first()
+    if question is None:
+        print(f"Question with ID {question_id} not found in chat {chat_id}.")
+        return
+    publish_answer(chat, question)
+    summarize_chat.delay(str(chat.id))
+
+
+@shared_task
+def generate_chat_title(chat_id, query, placeholder_title):
+    """
+    Replace the ``placeholder_title`` of a new chat with one written by the
+    LLM from its first question, unless the title has changed meanwhile.
+    """
+    title = get_chat_title_from_llm(query.strip())
+    if not title:
+        return
+    Chat.objects.filter(id=chat_id, title=placeholder_title).update(
+        title=title[: Chat._meta.get_field("title").max_length]
     )
+
+
+@shared_task
+def summarize_chat(chat_id):
+    """
+    Fold the messages of a chat that have dropped out of its recent history
+    (all but the last PROMPT_HISTORY_MESSAGES) into its rolling summary.
+    """
+    chat = Chat.objects.filter(id=chat_id).first()
+    if not chat:
+        print(f"Chat with ID {chat_id} not found.")
+        return
+
+    messages = ChatConversation.objects.filter(chat=chat).order_by("-created_at")
+    if chat.summarized_until:
+        messages = messages.filter(created_at__gt=chat.summarized_until)
+    older = list(reversed(messages[settings.PROMPT_HISTORY_MESSAGES :]))
+    if not older:
+        return
+
+    # Folded a history-sized batch at a time, so no message is left out.
+    summary, summarized_until, folded = chat.summary, chat.summarized_until, 0
+    for batch in history_batches(older):
+        updated_summary = get_updated_chat_summary(
+            summary, pack_history(batch), settings.CHAT_SUMMARY_TOKENS
+        )
+        if updated_summary is None:
+            break
+        summary = truncate_to_tokens(updated_summary, settings.CHAT_SUMMARY_TOKENS)
+        # Another run may have folded the same messages meanwhile.
+        updated = Chat.objects.filter(
+            id=chat.id, summarized_until=summarized_until
+        ).update(summary=summary, summarized_until=batch[-1].created_at)
+        if not updated:
+            break
+        summarized_until = batch[-1].created_at
+        folded += len(batch)
+    if folded:
+        print(f"Summarized {folded} messages of chat {chat.id}")
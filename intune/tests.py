@@ -1,3 +1,1026 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import numpy as np
+import pymupdf
+from billiard.pool import Pool
+from asgiref.sync import sync_to_async
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from benchmarks.fake_openai import CANNED_ANSWER, FakeOpenAIServer
+from intune import openai_client
+from intune.cache import get_redis
+from intune.ingestion.chunking import SlidingWindowChunker
+from intune.ingestion.embedding import iter_embedding_batches
+from intune.ingestion.embedding_cache import cache_embeddings, get_cached_embeddings
+from intune.ingestion.extraction import (
+    iter_document_segments,
+    iter_pdf_pages,
+    iter_text_sections,
+)
+from intune.ingestion.persistence import DocumentChunkWriter
+from intune.models import (
+    CachedAnswer,
+    Chat,
+    ChatConversation,
+    Document,
+    DocumentChunk,
+    Team,
+    TeamMember,
+    User,
+)
+from intune.retrieval.answer_cache import cache_answer, find_cached_answer
+from intune.retrieval.context import pack_history, pack_snippets
+from intune.retrieval.query_embedding_cache import (
+    cache_query_embedding,
+    get_cached_query_embedding,
+)
+from intune.retrieval.records import ChunkRecord, DocumentRecord
+from intune.retrieval.rerank import mmr_select
+from intune.retrieval.search import (
+    search_chunks,
+    search_in_memory,
+    search_in_postgres,
+)
+from intune.retrieval.vector_index import clear_team_indexes, get_team_index
+from intune.answering import prepare_answer
+from intune.partitions import chunk_partition_name, create_chunk_partition
+from intune.openai_client import CircuitOpenError, OpenAIError, RateLimitTimeout
+from intune.tasks import (
+    answer_question,
+    generate_chat_title,
+    reingest_document,
+    summarize_chat,
+)
+from intune.timing import StageTimer
+from intune.tokens import count_tokens
+from intune.utils import heuristic_chat_title
+
+
+class EmbeddingBatchTests(SimpleTestCase):
+    def batch_indexes(self, chunks, **limits):
+        return [
+            [chunk[0] for chunk in batch]
+            for batch in iter_embedding_batches(chunks, **limits)
+        ]
+
+    def test_batches_are_capped_by_inputs(self):
+        chunks = [(i, f"chunk {i}") for i in range(5)]
+        self.assertEqual(
+            self.batch_indexes(chunks, max_items=2, max_tokens=1000),
+            [[0, 1], [2, 3], [4]],
+        )
+
+    def test_batches_are_capped_by_tokens(self):
+        # "word " is one token.
+        chunks = [
+            (0, "word " * 10, {"pages": [1]}),
+            (1, "word " * 10, {"pages": [1]}),
+            (2, "word " * 10, {"pages": [2]}),
+            (3, "word " * 40, {"pages": [2]}),
+            (4, "word " * 5, {"pages": [3]}),
+        ]
+        self.assertEqual(
+            self.batch_indexes(chunks, max_items=100, max_tokens=25),
+            [[0, 1], [2], [3], [4]],
+        )
+        # Chunks are passed through untouched, in order.
+        batches = list(iter_embedding_batches(chunks, max_items=100, max_tokens=25))
+        self.assertEqual([chunk for batch in batches for chunk in batch], chunks)
+
+
+class SlidingWindowChunkerTests(SimpleTestCase):
+    def setUp(self):
+        # Four pages of three paragraphs of four sentences each, then one
+        # page holding a single sentence far longer than a chunk.
+        self.sentence_pages, self.pages = {}, []
+        for page_number in range(1, 5):
+            paragraphs = []
+            for _ in range(3):
+                sentences = []
+                for _ in range(4):
+                    number = len(self.sentence_pages) + 1
+                    sentence = f"Sentence {number} explains leave policy rule {number}."
+                    self.sentence_pages[sentence] = page_number
+                    sentences.append(sentence)
+                paragraphs.append(" ".join(sentences))
+            self.pages.append((page_number, "\n\n".join(paragraphs)))
+        self.long_words = [f"word{i}" for i in range(100)]
+        self.pages.append((5, " ".join(self.long_words) + "."))
+        self.chunks = list(SlidingWindowChunker(60, 15).chunk(self.pages))
+
+    def test_chunks_stay_within_the_target(self):
+        self.assertEqual(
+            [chunk.index for chunk in self.chunks], list(range(len(self.chunks)))
+        )
+        for chunk in self.chunks:
+            self.assertLessEqual(count_tokens(chunk.text), 60)
+
+    def test_no_text_is_lost(self):
+        for sentence in self.sentence_pages:
+            self.assertTrue(
+                any(sentence in chunk.text for chunk in self.chunks), sentence
+            )
+        words = " ".join(chunk.text for chunk in self.chunks).split()
+        self.assertLessEqual(set(self.long_words), {word.rstrip(".") for word in words})
+
+    def test_neighbouring_chunks_overlap(self):
+        # Slices of the long sentence are longer than the overlap.
+        chunks = [chunk for chunk in self.chunks if "word" not in chunk.text]
+        self.assertGreater(len(chunks), 10)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            first_sentence = chunk.text.split(".")[0] + "."
+            self.assertTrue(previous.text.endswith(first_sentence))
+
+    def test_page_metadata(self):
+        for chunk in self.chunks:
+            pages = {
+                page
+                for sentence, page in self.sentence_pages.items()
+                if sentence in chunk.text
+            }
+            if "word0" in chunk.text or "word99" in chunk.text:
+                pages.add(5)
+            if pages:
+                self.assertEqual(chunk.metadata["pages"], sorted(pages))
+        self.assertEqual(self.chunks[-1].metadata, {"pages": [5]})
+
+    def test_sections_end_paragraphs(self):
+        sections = [(1, "Intro line"), (2, "# Heading\n\nPara a"), (3, "- bullet")]
+        chunks = list(SlidingWindowChunker(60, 0).chunk(sections, "sections"))
+        self.assertEqual(
+            [chunk.text for chunk in chunks],
+            ["Intro line\n\n# Heading\n\nPara a\n\n- bullet"],
+        )
+        self.assertEqual(chunks[0].metadata, {"sections": [1, 2, 3]})
+
+        # A page that does not end like a sentence runs on into the next.
+        pages = [(1, "The policy applies to"), (2, "all employees.")]
+        chunks = list(SlidingWindowChunker(60, 0).chunk(pages))
+        self.assertEqual(chunks[0].text, "The policy applies to all employees.")
+
+
+class TextSectionTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, text):
+        file_path = os.path.join(self.directory, name)
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return file_path
+
+    def test_markdown_is_split_at_headings(self):
+        file_path = self.write(
+            "handbook.md",
+            "Intro line\n# Leave\nPara a\n```\n# not a heading\n```\n## Pay\n- bullet\n",
+        )
+        self.assertEqual(
+            list(iter_text_sections(file_path, markdown=True, max_section_chars=1000)),
+            [
+                (1, "Intro line\n"),
+                (2, "# Leave\nPara a\n```\n# not a heading\n```\n"),
+                (3, "## Pay\n- bullet\n"),
+            ],
+        )
+
+    def test_plain_text_is_split_at_blank_lines(self):
+        file_path = self.write("handbook.txt", "# Alpha\nBeta\n\nGamma\n")
+        self.assertEqual(
+            list(iter_text_sections(file_path, max_section_chars=8)),
+            [(1, "# Alpha\nBeta\n\n"), (2, "Gamma\n")],
+        )
+
+    def test_document_segments_by_content_type(self):
+        file_path = self.write("handbook.md", "# Leave\nPara a\n# Pay\nPara b\n")
+
+        def segments(content_type):
+            document = SimpleNamespace(
+                file=SimpleNamespace(path=file_path), content_type=content_type
+            )
+            segments, location_key = iter_document_segments(document)
+            return segments and list(segments), location_key
+
+        self.assertEqual(
+            segments("text/markdown"),
+            ([(1, "# Leave\nPara a\n"), (2, "# Pay\nPara b\n")], "sections"),
+        )
+        self.assertEqual(
+            segments("text/plain"),
+            ([(1, "# Leave\nPara a\n# Pay\nPara b\n")], "sections"),
+        )
+        self.assertEqual(segments("application/msword"), (None, None))
+
+
+def extract_pdf_in_parallel(file_path):
+    return list(iter_pdf_pages(file_path, workers=2, pages_per_range=3))
+
+
+class PdfExtractionTests(SimpleTestCase):
+    def test_parallel_extraction_in_a_prefork_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "handbook.pdf")
+            with pymupdf.open() as doc:
+                for number in range(1, 11):
+                    doc.new_page().insert_text((72, 72), f"Page {number}")
+                doc.save(file_path)
+
+            # Celery's prefork children are daemonic, like this pool's.
+            with Pool(processes=1) as worker:
+                pages = worker.apply_async(extract_pdf_in_parallel, (file_path,)).get(
+                    timeout=60
+                )
+
+        self.assertEqual([number for number, _ in pages], list(range(1, 11)))
+        self.assertEqual([text.strip() for _, text in pages][-1], "Page 10")
+
+
+class EmbeddingCacheTests(TestCase):
+    def test_local_caches_hold_float32_arrays(self):
+        embedding = [0.25] * 1536
+        cache_query_embedding("How much PTO do I get?", embedding)
+        cached = get_cached_query_embedding("how much PTO do I get?")
+        self.assertEqual(cached.dtype, np.float32)
+        np.testing.assert_array_equal(cached, embedding)
+
+        chunks = [(0, "Paragraph about PTO.")]
+        cache_embeddings(chunks, {0: embedding})
+        cached = get_cached_embeddings(chunks)[0]
+        self.assertEqual(cached.dtype, np.float32)
+        np.testing.assert_array_equal(cached, embedding)
+
+
+@override_settings(OPENAI_RATE_LIMIT_ENABLED=True, OPENAI_RATE_LIMIT_MAX_WAIT=0.1)
+class OpenAIClientTests(SimpleTestCase):
+    def setUp(self):
+        self.model = f"test-{uuid.uuid4().hex}"
+        keys = [
+            f"openai:ratelimit:{self.model}:requests",
+            f"openai:ratelimit:{self.model}:tokens",
+            openai_client.CIRCUIT_FAILURES_KEY,
+            openai_client.CIRCUIT_OPEN_KEY,
+        ]
+        get_redis().delete(*keys)
+        self.addCleanup(get_redis().delete, *keys)
+        # 10 tokens a second.
+        self.enterContext(
+            override_settings(
+                OPENAI_RATE_LIMITS={
+                    self.model: {"requests_per_minute": 6000, "tokens_per_minute": 600}
+                }
+            )
+        )
+
+    def post(self, responses):
+        """``post_json`` against a transport replying with ``responses``."""
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return responses[min(len(requests), len(responses)) - 1]
+
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        self.addCleanup(client.close)
+        return openai_client.post_json("embeddings", {}, self.model, 1, client=client)
+
+    def test_token_bucket_refills(self):
+        openai_client.acquire(self.model, 600)
+        with self.assertRaises(RateLimitTimeout):
+            openai_client.acquire(self.model, 5)
+
+        start = time.monotonic()
+        with override_settings(OPENAI_RATE_LIMIT_MAX_WAIT=5):
+            openai_client.acquire(self.model, 5)
+        self.assertGreater(time.monotonic() - start, 0.3)
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_requests_above_capacity_are_clamped(self):
+        # Would never be granted if it had to fit in the bucket as asked.
+        start = time.monotonic()
+        openai_client.acquire(self.model, 10_000)
+        self.assertLess(time.monotonic() - start, 0.1)
+        with self.assertRaises(RateLimitTimeout):
+            openai_client.acquire(self.model, 5)
+
+    @override_settings(OPENAI_RATE_LIMIT_ENABLED=False)
+    def test_throttling_honours_retry_after(self):
+        throttled = httpx.Response(429, headers={"retry-after-ms": "300"})
+        start = time.monotonic()
+        self.assertEqual(self.post([throttled, httpx.Response(200, json={})]), {})
+        self.assertGreaterEqual(time.monotonic() - start, 0.3)
+
+        with override_settings(OPENAI_MAX_RETRIES=1):
+            with self.assertRaises(OpenAIError):
+                self.post([throttled])
+        self.assertFalse(get_redis().exists(openai_client.CIRCUIT_FAILURES_KEY))
+
+    @override_settings(
+        OPENAI_RATE_LIMIT_ENABLED=False,
+        OPENAI_MAX_RETRIES=2,
+        OPENAI_CIRCUIT_THRESHOLD=3,
+        OPENAI_CIRCUIT_COOLDOWN=1,
+    )
+    def test_circuit_opens_after_failures(self):
+        failing = httpx.Response(500, text="upstream down")
+        with mock.patch("intune.openai_client._backoff", return_value=0):
+            with self.assertRaises(OpenAIError):
+                self.post([failing])
+            with self.assertRaises(CircuitOpenError):
+                self.post([httpx.Response(200, json={})])
+
+            # After the cooldown a probe is let through, and its success
+            # resets the failure count.
+            time.sleep(1.1)
+            self.assertEqual(self.post([httpx.Response(200, json={})]), {})
+        self.assertFalse(get_redis().exists(openai_client.CIRCUIT_FAILURES_KEY))
+
+
+def fake_embeddings(document_id, chunks):
+    return {chunk[0]: [0.1] * 1536 for chunk in chunks}
+
+
+@override_settings(INGESTION_CHUNKER="page", TEXT_SECTION_MAX_CHARS=8)
+class ReingestDocumentTests(TestCase):
+    """Every (short) paragraph of the text file is one chunk, indexed from 1."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, "documents"))
+
+        self.team = Team.objects.create(name="Re-ingestion")
+        self.document = Document.objects.create(
+            team=self.team,
+            name="handbook.txt",
+            file="documents/handbook.txt",
+            content_type="text/plain",
+            is_searchable=True,
+            status="completed",
+        )
+        with DocumentChunkWriter(self.document.id, self.team.id) as writer:
+            for index, text in enumerate(["Alpha.", "Bravo.", "Charlie.", "Bravo."], 1):
+                writer.add(index, text, [0.2] * 1536, {"sections": [index]})
+        self.rows = {
+            (row.chunk_index, row.text): row.id
+            for row in DocumentChunk.objects.filter(document=self.document)
+        }
+
+    def reingest(self, paragraphs, old_file_name=None):
+        with open(self.document.file.path, "w") as f:
+            f.write("\n\n".join(paragraphs) + "\n\n")
+        with mock.patch(
+            "intune.tasks.embed_document_chunks", side_effect=fake_embeddings
+        ) as embed:
+            reingest_document(self.document.id, old_file_name)
+        self.document.refresh_from_db()
+        return embed
+
+    def test_only_new_chunks_are_embedded(self):
+        embed = self.reingest(["Bravo.", "Alpha.", "Delta.", "Bravo."])
+
+        embedded = [
+            chunk.text for call in embed.call_args_list for chunk in call.args[1]
+        ]
+        self.assertEqual(embedded, ["Delta."])
+        rows = DocumentChunk.objects.filter(document=self.document)
+        self.assertEqual(
+            sorted((row.chunk_index, row.text, row.metadata) for row in rows),
+            [
+                (1, "Bravo.", {"sections": [1]}),
+                (2, "Alpha.", {"sections": [2]}),
+                (3, "Delta.", {"sections": [3]}),
+                (4, "Bravo.", {"sections": [4]}),
+            ],
+        )
+        ids = {row.chunk_index: row.id for row in rows}
+        # Moved chunks keep their rows; of two identical chunks, the one
+        # already at the right index stays there.
+        self.assertEqual(ids[1], self.rows[(2, "Bravo.")])
+        self.assertEqual(ids[2], self.rows[(1, "Alpha.")])
+        self.assertEqual(ids[4], self.rows[(4, "Bravo.")])
+        self.assertNotIn(ids[3], self.rows.values())
+        self.assertEqual(self.document.status, "completed")
+        self.assertEqual(self.document.chunk_count, 4)
+
+    def test_removed_chunks_are_deleted(self):
+        embed = self.reingest(["Alpha.", "Bravo."])
+
+        embed.assert_not_called()
+        rows = DocumentChunk.objects.filter(document=self.document)
+        self.assertEqual(
+            sorted((row.chunk_index, row.text, row.id) for row in rows),
+            [
+                (1, "Alpha.", self.rows[(1, "Alpha.")]),
+                (2, "Bravo.", self.rows[(2, "Bravo.")]),
+            ],
+        )
+        self.assertEqual(self.document.chunk_count, 2)
+
+    def test_failures_mark_the_document_failed(self):
+        old_file = self.document.file.storage.save(
+            "documents/handbook_v1.txt", ContentFile(b"Alpha.")
+        )
+        # The file is read lazily, after the document is marked processing.
+        with self.assertRaises(FileNotFoundError):
+            reingest_document(self.document.id, old_file)
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.status, "failed")
+        self.assertIn("handbook.txt", self.document.error)
+        self.assertEqual(
+            DocumentChunk.objects.filter(document=self.document).count(), 4
+        )
+        self.assertTrue(self.document.file.storage.exists(old_file))
+
+    def test_old_file_is_deleted_once_reingested(self):
+        old_file = self.document.file.storage.save(
+            "documents/handbook_v1.txt", ContentFile(b"Alpha.")
+        )
+        self.reingest(["Alpha.", "Bravo."], old_file)
+
+        self.assertEqual(self.document.status, "completed")
+        self.assertFalse(self.document.file.storage.exists(old_file))
+        self.assertTrue(self.document.file.storage.exists(self.document.file.name))
+
+    def test_new_version_keeps_concurrent_updates(self):
+        self.document.file.storage.save(self.document.file.name, ContentFile(b""))
+        stale = Document.objects.get(id=self.document.id)
+        Document.objects.filter(id=self.document.id).update(
+            metadata={"owner": "hr"},
+            chunk_count=4,
+            embedding_cache_hits=F("embedding_cache_hits") + 3,
+        )
+
+        stale.start_new_version(
+            SimpleUploadedFile("handbook.txt", b"Alpha.", content_type="text/plain")
+        )
+
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.version, 2)
+        self.assertEqual(self.document.status, "pending")
+        self.assertEqual(self.document.embedding_cache_hits, 0)
+        self.assertNotEqual(self.document.file.name, "documents/handbook.txt")
+        # Fields the new version doesn't touch are not overwritten.
+        self.assertEqual(self.document.metadata, {"owner": "hr"})
+        self.assertEqual(self.document.chunk_count, 4)
+        self.assertTrue(self.document.is_searchable)
+
+
+class ChunkPartitionTests(TestCase):
+    def parent_of(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT inhparent::regclass::text FROM pg_inherits "
+                "WHERE inhrelid = to_regclass(%s)",
+                [table],
+            )
+            row = cursor.fetchone()
+        return row and row[0]
+
+    def test_team_partition_lifecycle(self):
+        team = Team.objects.create(name="Partitioned")
+        partition = chunk_partition_name(team.id)
+        self.assertEqual(self.parent_of(partition), "document_chunks")
+        # Creating it again is a no-op.
+        create_chunk_partition(team.id)
+
+        document = Document.objects.create(team=team, name="handbook.txt")
+        with DocumentChunkWriter(document.id, team.id) as writer:
+            writer.add(1, "Alpha.", [0.1] * 1536, {"sections": [1]})
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{partition}"')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            # Fire the deferred foreign key checks, as the commit of the
+            # ingestion transaction would.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+
+        team.delete()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [partition])
+            self.assertIsNone(cursor.fetchone()[0])
+        self.assertFalse(DocumentChunk.objects.filter(team_id=team.id).exists())
+        self.assertFalse(Document.objects.filter(id=document.id).exists())
+
+
+def unit_vector(similarity):
+    """A 1536-d unit vector with cosine ``similarity`` to ``unit_vector(1)``."""
+    vector = [0.0] * 1536
+    vector[0], vector[1] = similarity, (1 - similarity**2) ** 0.5
+    return vector
+
+
+@override_settings(ANSWER_CACHE_ENABLED=True, ANSWER_CACHE_SIMILARITY=0.97)
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Answer cache")
+        self.document = Document.objects.create(
+            team=self.team, name="handbook.txt", is_searchable=True
+        )
+        with DocumentChunkWriter(self.document.id, self.team.id) as writer:
+            writer.add(1, "Alpha.", [0.1] * 1536, {"sections": [1]})
+        cache_answer(
+            self.team,
+            self.team.documents_version,
+            "How much PTO do I get?",
+            unit_vector(1),
+            DocumentChunk.objects.filter(document=self.document),
+            "25 days.",
+        )
+
+    def find(self, similarity, documents_version=None):
+        self.team.refresh_from_db()
+        if documents_version is None:
+            documents_version = self.team.documents_version
+        return find_cached_answer(self.team, unit_vector(similarity), documents_version)
+
+    def test_only_similar_questions_hit(self):
+        self.assertEqual(self.find(0.99).answer, "25 days.")
+        self.assertIsNone(self.find(0.9))
+        self.assertEqual(CachedAnswer.objects.get().hits, 1)
+
+    def test_changed_documents_invalidate_answers(self):
+        version = self.team.documents_version
+        self.assertIsNone(self.find(1, version + 1))
+
+        Team.documents_changed(self.team.id)
+        self.assertIsNone(self.find(1, version))
+        self.assertFalse(CachedAnswer.objects.exists())
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.documents_version, version + 1)
+
+    def test_deleting_a_document_invalidates_answers(self):
+        version = self.team.documents_version
+        self.document.delete()
+
+        self.assertFalse(CachedAnswer.objects.exists())
+        self.team.refresh_from_db()
+        self.assertEqual(self.team.documents_version, version + 1)
+
+    def test_answers_with_missing_chunks_are_dropped(self):
+        DocumentChunk.objects.filter(document=self.document).delete()
+
+        self.assertIsNone(self.find(1))
+        self.assertFalse(CachedAnswer.objects.exists())
+
+
+class InMemoryVectorIndexTests(TestCase):
+    """The in-memory index must return what the Postgres search returns."""
+
+    def setUp(self):
+        clear_team_indexes()
+        self.rng = np.random.default_rng(0)
+        self.team = Team.objects.create(name="Vector index")
+        self.documents = [self.add_document(f"doc-{i}.pdf", 40) for i in range(3)]
+        self.queries = self.rng.normal(size=(10, 1536)).tolist()
+
+    def tearDown(self):
+        clear_team_indexes()
+
+    def add_document(self, name, chunk_count, searchable=True):
+        document = Document.objects.create(
+            team=self.team,
+            name=name,
+            file=f"documents/{name}",
+            is_searchable=searchable,
+            chunk_count=chunk_count,
+        )
+        with DocumentChunkWriter(document.id, self.team.id) as writer:
+            for i in range(chunk_count):
+                text = f"{name} paragraph {i}"
+                if i == 7:
+                    text += " mentions error ERR-4021"
+                writer.add(i, text, self.rng.normal(size=1536).tolist())
+        Team.documents_changed(self.team.id)
+        self.team.refresh_from_db()
+        return document
+
+    def search(self, in_memory, **kwargs):
+        with override_settings(IN_MEMORY_VECTOR_INDEX_ENABLED=in_memory):
+            return [search_chunks(self.team, query, **kwargs) for query in self.queries]
+
+    def assertSameResults(self, **kwargs):
+        expected = self.search(False, **kwargs)
+        found = self.search(True, **kwargs)
+        for expected_chunks, found_chunks in zip(expected, found):
+            self.assertEqual(
+                [chunk.id for chunk in found_chunks],
+                [chunk.id for chunk in expected_chunks],
+            )
+            for found_chunk, expected_chunk in zip(found_chunks, expected_chunks):
+                self.assertAlmostEqual(
+                    found_chunk.distance, expected_chunk.distance, places=5
+                )
+                self.assertEqual(found_chunk.document.id, expected_chunk.document.id)
+
+    def test_vector_search_matches_postgres(self):
+        self.assertSameResults(limit=4)
+        self.assertSameResults(limit=25)
+
+    @override_settings(HYBRID_SEARCH_ENABLED=True)
+    def test_hybrid_search_matches_postgres(self):
+        self.assertSameResults(limit=4, query_text="ERR-4021")
+        results = self.search(True, limit=4, query_text="ERR-4021")
+        for chunks in results:
+            self.assertTrue(any("ERR-4021" in chunk.text for chunk in chunks))
+
+    @override_settings(HYBRID_SEARCH_ENABLED=True)
+    def test_keyword_hits_on_chunks_written_before_the_version_bump(self):
+        get_team_index(self.team)
+        # Chunks are committed before documents_version is bumped.
+        with DocumentChunkWriter(self.documents[0].id, self.team.id) as writer:
+            writer.add(40, "new policy ERR-5050", self.rng.normal(size=1536).tolist())
+
+        results = self.search(True, limit=4, query_text="ERR-5050")
+        for chunks in results:
+            self.assertIn("new policy ERR-5050", [chunk.text for chunk in chunks])
+        self.assertSameResults(limit=4, query_text="ERR-5050")
+
+    @override_settings(HYBRID_SEARCH_ENABLED=True)
+    def test_similarities_match_postgres(self):
+        document_ids = [document.id for document in self.documents]
+        for query_text in (None, "ERR-4021"):
+            expected = search_in_postgres(
+                self.team,
+                document_ids,
+                self.queries[0],
+                20,
+                None,
+                query_text,
+                with_similarities=True,
+            )
+            found = search_in_memory(
+                self.team,
+                document_ids,
+                self.queries[0],
+                20,
+                query_text,
+                with_similarities=True,
+            )
+            self.assertEqual(
+                [chunk.id for chunk in found], [chunk.id for chunk in expected]
+            )
+            np.testing.assert_allclose(
+                [chunk.similarities for chunk in found],
+                [chunk.similarities for chunk in expected],
+                atol=1e-5,
+            )
+
+    def test_unsearchable_documents_are_excluded(self):
+        hidden = self.add_document("draft.pdf", 40, searchable=False)
+        for chunks in self.search(True, limit=50):
+            self.assertNotIn(hidden.id, {chunk.document_id for chunk in chunks})
+        self.assertSameResults(limit=10)
+
+    def test_index_follows_added_and_removed_chunks(self):
+        index = get_team_index(self.team)
+        self.assertEqual(len(index), 120)
+
+        added = self.add_document("new.pdf", 20)
+        self.assertSameResults(limit=10)
+        self.assertEqual(len(get_team_index(self.team)), 140)
+
+        DocumentChunk.objects.filter(document=self.documents[0]).delete()
+        self.documents[0].delete()
+        self.team.refresh_from_db()
+        self.assertSameResults(limit=10)
+        index = get_team_index(self.team)
+        self.assertEqual(len(index), 100)
+        self.assertIn(added.id, index.document_ids)
+
+
+class MMRTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.query = rng.normal(size=64)
+        self.other = rng.normal(size=64)
+
+    def near(self, vector, weight, seed):
+        noise = np.random.default_rng(seed).normal(size=vector.shape)
+        return weight * vector + 0.05 * noise
+
+    def select(self, embeddings, k, relevance=None, **kwargs):
+        embeddings = np.asarray(embeddings)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        if relevance is None:
+            relevance = embeddings @ (self.query / np.linalg.norm(self.query))
+        return mmr_select(relevance, embeddings @ embeddings.T, k, **kwargs)
+
+    def test_near_duplicates_are_skipped(self):
+        boilerplate = self.near(self.query, 1.0, 1)
+        embeddings = [
+            boilerplate,
+            boilerplate + 0.01,
+            boilerplate - 0.01,
+            self.near(self.query, 1.0, 2) + 0.8 * self.other,
+        ]
+        self.assertEqual(self.select(embeddings, 2, weight=0.5), [0, 3])
+        self.assertEqual(self.select(embeddings, 2, weight=1.0), [0, 1])
+
+    def test_chunks_per_document_are_capped(self):
+        embeddings = [self.near(self.query, 1.0, seed) for seed in range(6)]
+        groups = ["a", "a", "a", "a", "b", "b"]
+        relevance = [1.0, 0.9, 0.8, 0.7, 0.2, 0.1]
+        picks = self.select(
+            embeddings,
+            4,
+            relevance=relevance,
+            weight=1.0,
+            groups=groups,
+            max_per_group=2,
+        )
+        self.assertEqual(picks, [0, 1, 4, 5])
+
+        # The cap is lifted when too few documents remain.
+        picks = self.select(
+            embeddings[:4],
+            3,
+            relevance=relevance[:4],
+            weight=1.0,
+            groups=groups[:4],
+            max_per_group=2,
+        )
+        self.assertEqual(picks, [0, 1, 2])
+
+
+class ContextPackingTests(SimpleTestCase):
+    def setUp(self):
+        document = DocumentRecord(
+            "d1", "handbook.pdf", "documents/handbook.pdf", "application/pdf", 1, None
+        )
+        self.chunks = []
+        for i, distance in enumerate([0.1, 0.2, 0.9, 0.3]):
+            chunk = ChunkRecord("c%d" % i, "d1", i, f"chunk {i} " * 100, distance)
+            chunk.document = document
+            self.chunks.append(chunk)
+
+    def test_far_chunks_are_dropped(self):
+        text, packed = pack_snippets(self.chunks, budget=10000, max_distance=0.5)
+        self.assertEqual([chunk.id for chunk in packed], ["c0", "c1", "c3"])
+        self.assertIn("[Snippet 3] doc d1 chunk 3", text)
+
+    def test_budget_keeps_best_chunks_and_truncates_the_last(self):
+        one = count_tokens(pack_snippets(self.chunks[:1], budget=10000)[0])
+        text, packed = pack_snippets(self.chunks, budget=one + 200, max_distance=0.5)
+        self.assertEqual([chunk.id for chunk in packed], ["c0", "c1"])
+        self.assertLessEqual(count_tokens(text), one + 200)
+
+        text, packed = pack_snippets(self.chunks, budget=one + 10, max_distance=0.5)
+        self.assertEqual([chunk.id for chunk in packed], ["c0"])
+
+    def test_history_keeps_newest_messages(self):
+        conversations = [
+            ChatConversation(sender="user", message=f"question {i} " * 50)
+            for i in range(4)
+        ]
+        history = pack_history(conversations, budget=count_tokens(history_line(3)) + 5)
+        self.assertEqual(history, history_line(3) + "\n")
+        self.assertEqual(pack_history(conversations, budget=10).count("\n"), 1)
+
+
+class ChatSummaryTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(email="summary@example.com", full_name="Summary")
+        self.team = Team.objects.create(name="Summaries")
+        self.chat = Chat.objects.create(
+            team=self.team, user=user, title="PTO", is_conversation_active=True
+        )
+        for turn in range(3):
+            self.say("user", f"question {turn}")
+            self.say(
+                "bot",
+                f'answer {turn}<hr/><div class="llm-sources"><ol>'
+                f'<li><a href="/media/handbook-{turn}.pdf">Handbook</a></li>'
+                f"</ol></div>",
+            )
+        self.server = FakeOpenAIServer(latency_ms=0).__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def say(self, sender, message):
+        return ChatConversation.objects.create(
+            chat=self.chat, sender=sender, message=message
+        )
+
+    def test_summary_covers_all_but_recent_messages(self):
+        with override_settings(
+            OPENAI_API_BASE=self.server.base_url, PROMPT_HISTORY_MESSAGES=4
+        ):
+            summarize_chat(str(self.chat.id))
+            self.chat.refresh_from_db()
+            self.assertEqual(self.chat.summary, CANNED_ANSWER)
+            second = ChatConversation.objects.get(
+                chat=self.chat, message__startswith="answer 0"
+            )
+            self.assertEqual(self.chat.summarized_until, second.created_at)
+            # Nothing new has left the recent history.
+            requests = self.server.requests
+            summarize_chat(str(self.chat.id))
+            self.assertEqual(self.server.requests, requests)
+
+            question = self.say("user", "question 3")
+            pending = prepare_answer(self.chat, question, StageTimer())
+
+        history = pending.prompt.split("RECENT CONVERSATION")[1]
+        history = history.split("DOCUMENT SNIPPETS")[0]
+        self.assertIn(
+            f"SUMMARY (everything before the recent conversation):\n        {CANNED_ANSWER}",
+            pending.prompt,
+        )
+        self.assertNotIn("question 0", history)
+        self.assertIn("User: question 1\nBot: answer 1\n", history)
+        self.assertIn("Bot: answer 2\n", history)
+        self.assertNotIn("handbook-", pending.prompt)
+
+    def test_long_backlogs_are_folded_in_batches(self):
+        # Each message is 4 or 5 tokens once its sources are stripped.
+        texts = []
+        with (
+            override_settings(PROMPT_HISTORY_MESSAGES=0, PROMPT_HISTORY_TOKENS=10),
+            mock.patch(
+                "intune.tasks.get_updated_chat_summary",
+                side_effect=lambda summary, text, _: texts.append(text) or text,
+            ),
+        ):
+            summarize_chat(str(self.chat.id))
+
+        self.assertEqual(len(texts), 3)
+        folded = "".join(texts)
+        for turn in range(3):
+            self.assertIn(f"User: question {turn}\nBot: answer {turn}\n", folded)
+        self.chat.refresh_from_db()
+        last = ChatConversation.objects.filter(chat=self.chat).latest("created_at")
+        self.assertEqual(self.chat.summarized_until, last.created_at)
+        self.assertEqual(self.chat.summary, "User: question 2\nBot: answer 2\n")
+
+
+class ChatAnswerStreamTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="stream@example.com", full_name="Stream")
+        self.team = Team.objects.create(name="Streaming")
+        TeamMember.objects.create(team=self.team, user=self.user, role="admin")
+        self.chat = Chat.objects.create(team=self.team, user=self.user, title="PTO")
+        self.question = ChatConversation.objects.create(
+            chat=self.chat, sender="user", message="How does PTO accrue?"
+        )
+        self.url = f"/{self.team.id}/chat/{self.chat.id}/stream/"
+        self.server = FakeOpenAIServer(latency_ms=0, token_ms=0).__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    async def stream(self, answer=False, **overrides):
+        """
+        Open the chat's event stream, run the answer_question task for
+        ``self.question`` if ``answer``, and return the streamed events.
+        """
+        await self.async_client.aforce_login(self.user)
+        overrides.setdefault("OPENAI_API_BASE", self.server.base_url)
+        with override_settings(**overrides):
+            response = await self.async_client.get(self.url)
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            if answer:
+                with mock.patch("intune.tasks.summarize_chat") as summarize_chat:
+                    await sync_to_async(answer_question)(
+                        str(self.chat.id), str(self.question.id)
+                    )
+                summarize_chat.delay.assert_called_once_with(str(self.chat.id))
+            body = b"".join([part async for part in response.streaming_content])
+        events = []
+        for block in body.decode().strip().split("\n\n"):
+            event, data = block.split("\n")
+            events.append((event[len("event: ") :], json.loads(data[len("data: ") :])))
+        return events
+
+    async def messages(self):
+        conversations = ChatConversation.objects.filter(chat=self.chat)
+        return [
+            (message.sender, message.message)
+            async for message in conversations.order_by("created_at")
+        ]
+
+    async def test_relays_and_saves_answer(self):
+        events = await self.stream(answer=True)
+        self.assertEqual(events[-1], ("done", None))
+        self.assertGreater(len(events), 2)
+        answer = "".join(data for event, data in events if event == "delta")
+        self.assertEqual(answer.strip(), CANNED_ANSWER)
+
+        messages = await self.messages()
+        self.assertEqual([sender for sender, _ in messages], ["user", "bot"])
+        self.assertEqual(messages[1][1], answer)
+        # Nothing left to answer.
+        self.assertEqual(await self.stream(), [("done", None)])
+
+    async def test_failed_answer_is_not_saved(self):
+        events = await self.stream(
+            answer=True, OPENAI_API_BASE="http://127.0.0.1:9/v1", OPENAI_MAX_RETRIES=0
+        )
+        self.assertEqual(events, [("failed", "The assistant is unavailable.")])
+        self.assertEqual(len(await self.messages()), 1)
+
+    async def test_unembeddable_question_fails_cleanly(self):
+        document = await Document.objects.acreate(
+            team=self.team, name="handbook.txt", is_searchable=True, chunk_count=1
+        )
+
+        def add_chunk():
+            with DocumentChunkWriter(document.id, self.team.id) as writer:
+                writer.add(1, "PTO accrues monthly.", [0.1] * 1536)
+
+        await sync_to_async(add_chunk)()
+        with mock.patch("intune.answering.get_query_embedding", return_value=None):
+            events = await self.stream(answer=True)
+        self.assertEqual(events, [("failed", "The assistant is unavailable.")])
+        self.assertEqual(len(await self.messages()), 1)
+
+    async def test_new_chat_queues_answer_and_title(self):
+        await self.async_client.aforce_login(self.user)
+        with (
+            mock.patch("intune.views.team.answer_question") as answer_question,
+            mock.patch("intune.views.team.generate_chat_title") as generate_title,
+        ):
+            response = await self.async_client.post(
+                f"/{self.team.id}/chat/", {"query": "When does PTO reset?"}
+            )
+        chat = await Chat.objects.exclude(id=self.chat.id).aget(team=self.team)
+        question = await ChatConversation.objects.aget(chat=chat)
+        self.assertRedirects(
+            response,
+            f"/{self.team.id}/chat/{chat.id}/",
+            fetch_redirect_response=False,
+        )
+        self.assertEqual(chat.title, "When does PTO reset?")
+        answer_question.delay.assert_called_once_with(str(chat.id), str(question.id))
+        generate_title.delay.assert_called_once_with(
+            str(chat.id), "When does PTO reset?", chat.title
+        )
+
+        with override_settings(OPENAI_API_BASE=self.server.base_url):
+            await sync_to_async(generate_chat_title)(
+                str(chat.id), "When does PTO reset?", chat.title
+            )
+        await chat.arefresh_from_db()
+        self.assertTrue(chat.title.startswith("This is a canned answer."))
+
+    async def test_answers_the_given_question(self):
+        first = self.question
+        self.question = await ChatConversation.objects.acreate(
+            chat=self.chat, sender="user", message="And in the second year?"
+        )
+        # The first question is answered after the second was asked.
+        with (
+            override_settings(OPENAI_API_BASE=self.server.base_url),
+            mock.patch("intune.tasks.summarize_chat"),
+        ):
+            await sync_to_async(answer_question)(str(self.chat.id), str(first.id))
+        self.assertEqual(
+            [sender for sender, _ in await self.messages()], ["user", "user", "bot"]
+        )
+
+        events = await self.stream(answer=True)
+        self.assertEqual(events[-1], ("done", None))
+        self.assertEqual(
+            [sender for sender, _ in await self.messages()],
+            ["user", "user", "bot", "bot"],
+        )
+        # Both answers streamed over the worker's keep-alive connection.
+        self.assertEqual(self.server.connections, 1)
+
+    async def test_page_shows_one_pending_answer(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(f"/{self.team.id}/chat/{self.chat.id}/")
+        self.assertContains(response, 'id="pending-answer"', count=1)
+
+    async def test_other_users_get_404(self):
+        other = await User.objects.acreate(email="other@example.com", full_name="O")
+        await self.async_client.aforce_login(other)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class HeuristicChatTitleTests(SimpleTestCase):
+    def test_titles(self):
+        self.assertEqual(
+            heuristic_chat_title("  How does\nPTO accrue? "), "How does PTO accrue?"
+        )
+        self.assertEqual(heuristic_chat_title(" "), "New Chat")
+        self.assertEqual(
+            heuristic_chat_title(" ".join(str(i) for i in range(20))),
+            "0 1 2 3 4 5 6 7 8 9…",
+        )
+        title = heuristic_chat_title("word " * 3 + "x" * 200)
+        self.assertEqual(title, "word word word…")
+
+
+def history_line(i):
+    return "User: " + (f"question {i} " * 50).strip()
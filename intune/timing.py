@@ -0,0 +1,51 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Accumulate wall-clock seconds per named stage.
+
+    Stages may nest, e.g. a chunker pulling pages from an extractor: time is
+    charged to the innermost running stage only, so the totals add up to the
+    time actually spent.
+
+        timer = StageTimer()
+        pages = timer.iterate("extract", iter_pdf_pages(path))
+        with timer.stage("embed"):
+            ...
+        timer.timings  # {"extract": 1.2, "embed": 0.4}
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+        self._mark = None
+
+    def _charge_running_stage(self):
+        now = time.perf_counter()
+        if self._stack:
+            name = self._stack[-1]
+            self.timings[name] = self.timings.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    @contextmanager
+    def stage(self, name):
+        self._charge_running_stage()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge_running_stage()
+            self._stack.pop()
+
+    def iterate(self, name, iterable):
+        """Wrap ``iterable`` so the time spent producing items counts as ``name``."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
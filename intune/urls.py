@@ -6,7 +6,7 @@ from django.conf import settings
 
 from intune.views.index import IndexView
 from intune.views.accounts import LoginView, LogoutView
-from intune.views.team import DashboardView, UploadView, ChatView, ChatConversationView, CreateTeamView
+from intune.views.team import DashboardView, UploadView, ChatView, ChatConversationView, ChatAnswerStreamView, CreateTeamView
 
 # fmt: off
 urlpatterns = [
@@ -16,6 +16,7 @@ urlpatterns = [
     path("<uuid:team_id>/upload/", UploadView.as_view(), name="upload"),
     path("<uuid:team_id>/chat/", ChatView.as_view(), name="chat"),
     path("<uuid:team_id>/chat/<uuid:chat_id>/", ChatConversationView.as_view(),name="chat-conversation"),
+    path("<uuid:team_id>/chat/<uuid:chat_id>/stream/", ChatAnswerStreamView.as_view(), name="chat-answer-stream"),
     path("<uuid:team_id>/", DashboardView.as_view(), name="dashboard"),
     path("", IndexView.as_view(), name="index"),
     path('create/', CreateTeamView.as_view(), name='create_team'),
@@ -1,58 +1,96 @@
-import httpx
 import json
 from django.conf import settings
 
+from intune.openai_client import (
+    OpenAIError,
+    post_json,
+    stream_chat_completion,
+)
+from intune.retrieval.query_embedding_cache import (
+    cache_query_embedding,
+    get_cached_query_embedding,
+)
+from intune.tokens import count_tokens
+
+
+def estimate_completion_tokens(json_data):
+    """
+    The token estimate of a chat completion request: the prompt plus the
+    whole completion budget, which is what the tokens-per-minute limit is
+    charged against upfront.
+    """
+    tokens = sum(count_tokens(message["content"]) for message in json_data["messages"])
+    return tokens + json_data.get("max_completion_tokens", 0)
+
+
+def get_chat_completion(json_data, timeout=60.0):
+    """POST a chat completion request through the shared rate limiter."""
+    return post_json(
+        "chat/completions",
+        json_data,
+        model=json_data["model"],
+        tokens=estimate_completion_tokens(json_data),
+        timeout=timeout,
+    )
+
 
 def get_query_embedding(query):
-    open_ai_api_key = settings.OPENAI_API_KEY
-    open_ai_url = "https://api.openai.com/v1/embeddings"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {open_ai_api_key}",
-    }
+    embedding = get_cached_query_embedding(query)
+    if embedding is not None:
+        return embedding
+
     json_data = {
         "input": query,
-        "model": "text-embedding-ada-002",
+        "model": settings.EMBEDDING_MODEL,
         "encoding_format": "float",
     }
-    response = httpx.post(open_ai_url, headers=headers, json=json_data)
-    if not response.status_code == 200:
-        print(f"Failed to get embedding")
+    try:
+        data = post_json(
+            "embeddings",
+            json_data,
+            model=settings.EMBEDDING_MODEL,
+            tokens=count_tokens(query),
+        )
+    except OpenAIError as exc:
+        print(f"Failed to get embedding: {exc}")
         return
 
-    return response.json()["data"][0]["embedding"]
+    embedding = data["data"][0]["embedding"]
+    cache_query_embedding(query, embedding)
+    return embedding
 
 
-def get_llm_response(prompt):
-    open_ai_api_key = settings.OPENAI_API_KEY
-    open_ai_url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {open_ai_api_key}",
-    }
-    json_data = {
+def llm_request(prompt):
+    return {
         "model": "gpt-5-nano",
         "messages": [{"role": "user", "content": prompt}],
         "max_completion_tokens": 20000,
     }
 
-    response = httpx.post(open_ai_url, headers=headers, json=json_data, timeout=60.0)
-    if not response.status_code == 200:
-        print("Response Details:", response.text)
-        print(f"Failed to get LLM response")
+
+def get_llm_response(prompt):
+    json_data = llm_request(prompt)
+
+    try:
+        data = get_chat_completion(json_data, timeout=60.0)
+    except OpenAIError as exc:
+        print(f"Failed to get LLM response: {exc}")
         return None
-    return response.json()["choices"][0]["message"]["content"]
+    return data["choices"][0]["message"]["content"]
 
 
-def get_chat_title_from_llm(conversation_summary):
+def stream_llm_response(prompt):
     """
-    Generate a concise (<= 10 words) chat title from a conversation summary
-    using the OpenAI Chat Completions endpoint. Returns the title string
-    or None on error.
+    Like ``get_llm_response``, but yields the answer in pieces as the model
+    writes it. Raises ``OpenAIError`` on failure.
     """
-    if not conversation_summary:
-        return None
+    json_data = llm_request(prompt)
+    yield from stream_chat_completion(
+        json_data, tokens=estimate_completion_tokens(json_data), timeout=60.0
+    )
+
 
+def chat_title_request(conversation_summary):
     prompt = f"""Generate a concise and descriptive title for the following chat conversation summary.
     The title should be no longer than 10 words and should capture the main topic of the conversation.
     Respond with only the title, without any additional text or formatting.
@@ -62,14 +100,7 @@ def get_chat_title_from_llm(conversation_summary):
 
     Output Format: <summary>"""
 
-    open_ai_api_key = settings.OPENAI_API_KEY
-    open_ai_url = "https://api.openai.com/v1/chat/completions"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {open_ai_api_key}",
-    }
-
-    json_data = {
+    return {
         "model": "gpt-5-nano",
         "messages": [
             {
@@ -81,22 +112,9 @@ def get_chat_title_from_llm(conversation_summary):
         "max_completion_tokens": 1000,
     }
 
-    try:
-        response = httpx.post(
-            open_ai_url, headers=headers, json=json_data, timeout=30.0
-        )
-    except httpx.RequestError as exc:
-        # network/connection error
-        print(f"Request failed: {exc}")
-        return None
-
-    if response.status_code != 200:
-        print("Response Details:", response.text)
-        print("Failed to get chat title from LLM")
-        return None
 
+def parse_chat_title(data):
     try:
-        data = response.json()
         # robustly find choice text
         choice = data["choices"][0]
         # both chat/completions and some responses might place text in different keys:
@@ -112,5 +130,79 @@ def get_chat_title_from_llm(conversation_summary):
         return title
     except (KeyError, IndexError, ValueError) as exc:
         print("Error parsing LLM response:", exc)
-        print("Response body:", response.text)
+        print("Response body:", data)
+        return None
+
+
+def get_updated_chat_summary(summary, conversation_text, max_tokens):
+    """
+    Fold ``conversation_text`` (the chat's next messages, oldest first) into
+    the running ``summary`` of a chat. Returns the new summary, or None on
+    error.
+    """
+    prompt = f"""Update the running summary of a conversation between a user and an assistant that answers from company documents.
+
+    Keep every fact, name, number, decision and open question the user may refer back to. Drop greetings, repetition and formatting.
+    The summary must stay under {max_tokens} tokens; condense older points first.
+    Respond with only the updated summary as plain text.
+
+    Current summary:
+    {summary or "(empty)"}
+
+    New messages (oldest -> newest):
+    {conversation_text}"""
+
+    json_data = {
+        "model": "gpt-5-nano",
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a helpful assistant that keeps concise conversation summaries.",
+            },
+            {"role": "user", "content": prompt},
+        ],
+        "max_completion_tokens": 2000,
+    }
+
+    try:
+        data = get_chat_completion(json_data, timeout=60.0)
+    except OpenAIError as exc:
+        print(f"Failed to get chat summary from LLM: {exc}")
+        return None
+    content = data["choices"][0]["message"].get("content")
+    return content.strip() if content else None
+
+
+def heuristic_chat_title(query, max_words=10, max_length=80):
+    """
+    A title for a chat made from its first question, used until the LLM
+    title is ready: the first ``max_words`` words, at most ``max_length``
+    characters.
+    """
+    words = query.split()
+    title = " ".join(words[:max_words])
+    if len(title) > max_length:
+        title = title[: max_length - 1].rsplit(" ", 1)[0] or title[: max_length - 1]
+        return title + "…"
+    if len(words) > max_words:
+        return title + "…"
+    return title or "New Chat"
+
+
+def get_chat_title_from_llm(conversation_summary):
+    """
+    Generate a concise (<= 10 words) chat title from a conversation summary
+    using the OpenAI Chat Completions endpoint. Returns the title string
+    or None on error.
+    """
+    if not conversation_summary:
+        return None
+
+    try:
+        data = get_chat_completion(
+            chat_title_request(conversation_summary), timeout=30.0
+        )
+    except OpenAIError as exc:
+        print(f"Failed to get chat title from LLM: {exc}")
         return None
+    return parse_chat_title(data)